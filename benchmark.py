@@ -0,0 +1,256 @@
+import argparse
+import json
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+import neat
+import numpy as np
+from car import Car
+from constants import START_POSITIONS
+from fleet import CarFleet, RADAR_DEGREES
+from network import BatchNetwork
+from session import GEOMETRIES, SimulationSession
+from train import WIDTH, HEIGHT, CAR_SIZE_X, CAR_SIZE_Y, BORDER_COLOR, MAX_DISTANCE, MAX_STEPS, config_path
+
+
+def seeded_genomes(config, count, seed):
+    # The same starting population every time for the same seed
+    random.seed(seed)
+    config.pop_size = count
+    return [g for _, g in sorted(neat.Population(config).population.items())]
+
+
+def random_actions(count, steps, seed):
+    # Seeded random actions for a whole fleet, one row per step
+    return np.random.default_rng(seed).integers(0, 4, (steps, count))
+
+
+def drive_fleet(track, start_pos, actions):
+    # A fleet driven by the given actions, with the rays and corners it checked on every step
+    # as (origin_x, origin_y, angle_rad, corner_x, corner_y, start_x, start_y) for the micro benchmarks
+    fleet = CarFleet(actions.shape[1], track.width, track.height, MAX_DISTANCE, start_pos, CAR_SIZE_X, CAR_SIZE_Y)
+    snapshots = []
+    for choices in actions:
+        moving = np.flatnonzero(fleet.alive)
+        if not moving.size:
+            break
+        previous = fleet.center[moving].copy()
+        fleet.apply_actions(choices)
+        fleet.update(track)
+
+        center = fleet.center[moving]
+        ray_rad = np.radians(360 - (fleet.angle[moving, None] + RADAR_DEGREES)).ravel()
+        origin_x = np.repeat(center[:, 0], len(RADAR_DEGREES))
+        origin_y = np.repeat(center[:, 1], len(RADAR_DEGREES))
+        corner_x, corner_y = fleet.corners(moving, center)
+        start_x, start_y = fleet.corners(moving, previous)
+        snapshots.append((origin_x, origin_y, ray_rad, corner_x, corner_y, start_x.ravel(), start_y.ravel()))
+    return snapshots
+
+
+def drive_cars(game_map, start_pos, count, steps, seed):
+    # Legacy Cars driven by seeded random actions, one snapshot per car step for the legacy benchmarks
+    rng = random.Random(seed)
+    snapshots = []
+    for _ in range(count):
+        car = Car(WIDTH, HEIGHT, MAX_DISTANCE, start_pos, CAR_SIZE_X, CAR_SIZE_Y, BORDER_COLOR)
+        for _ in range(steps):
+            car.angle += rng.choice((-10, 0, 10))
+            car.update(game_map)
+            if not car.is_alive():
+                break
+            snapshots.append((car.position.copy(), car.angle, car.speed, car.center, car.corners))
+    return snapshots
+
+
+def bench_cast_rays(track, snapshots):
+    for origin_x, origin_y, ray_rad, *_ in snapshots:
+        track.cast_rays(origin_x, origin_y, ray_rad, MAX_DISTANCE)
+    return sum(len(snapshot[0]) for snapshot in snapshots)
+
+
+def bench_box_hits(track, snapshots):
+    for _, _, _, corner_x, corner_y, _, _ in snapshots:
+        track.box_hits(corner_x, corner_y)
+    return sum(len(snapshot[3]) for snapshot in snapshots)
+
+
+def bench_sweep(track, snapshots):
+    for _, _, _, corner_x, corner_y, start_x, start_y in snapshots:
+        track.sweep(start_x, start_y, corner_x.ravel(), corner_y.ravel())
+    return sum(len(snapshot[5]) for snapshot in snapshots)
+
+
+def bench_fleet_update(track, fleet, actions):
+    fleet.reset()
+    car_steps = 0
+    for choices in actions:
+        car_steps += int(fleet.alive.sum())
+        fleet.apply_actions(choices)
+        fleet.update(track)
+    return car_steps
+
+
+def bench_batch_activate(network, inputs):
+    for data in inputs:
+        network.activate(data)
+    return len(inputs) * len(data)
+
+
+# The benchmarks below time the legacy Car and neat's FeedForwardNetwork, training no longer
+# runs them but they are kept as a reference for the batched versions above
+
+
+def bench_check_radar(game_map, snapshots, car):
+    for position, angle, speed, center, corners in snapshots:
+        car.angle, car.center = angle, center
+        car.radars.clear()
+        for degree in RADAR_DEGREES:
+            car.check_radar(degree, game_map)
+    return len(snapshots)
+
+
+def bench_check_collision(game_map, snapshots, car):
+    for position, angle, speed, center, corners in snapshots:
+        car.corners = corners
+        car.check_collision(game_map)
+    return len(snapshots)
+
+
+def bench_update(game_map, snapshots, car):
+    for position, angle, speed, center, corners in snapshots:
+        car.position.update(position)
+        car.angle, car.speed, car.speed_set, car.alive = angle, speed, True, True
+        car.update(game_map)
+    return len(snapshots)
+
+
+def bench_activate(nets, inputs):
+    for net in nets:
+        for data in inputs:
+            net.activate(data)
+    return len(nets) * len(inputs)
+
+
+def bench_generation(session, genomes, config):
+    session.run_generation(genomes, config, 0, show=False)
+    return int(session.env.fleet.time.sum())
+
+
+def measure(function, *args, repeat=3):
+    # Best throughput out of repeat runs, plus the peak traced memory of one extra run
+    best = 0
+    for _ in range(repeat):
+        start = perf_counter()
+        work = function(*args)
+        best = max(best, work / (perf_counter() - start))
+
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"throughput": best, "peak_kib": peak / 1024}
+
+
+def run_benchmarks(maps, pop_sizes, seed, repeat):
+    config = neat.config.Config(neat.DefaultGenome,
+                                neat.DefaultReproduction,
+                                neat.DefaultSpeciesSet,
+                                neat.DefaultStagnation,
+                                config_path)
+
+    genomes = seeded_genomes(config, 100, seed)
+    nets = [neat.nn.FeedForwardNetwork.create(g, config) for g in genomes]
+    rng = random.Random(seed)
+    inputs = [[rng.randrange(11) for _ in range(config.genome_config.num_inputs)] for _ in range(100)]
+
+    # Every network gets the same 100 inputs as the legacy benchmark, one batch per input
+    network = BatchNetwork.create(genomes, config)
+    batches = [np.tile(data, (len(genomes), 1)) for data in inputs]
+
+    results = {}
+    cases = {
+        "batch_activate": ("activations", bench_batch_activate, network, batches),
+        "legacy/activate": ("activations", bench_activate, nets, inputs),
+    }
+
+    for map_number in maps:
+        start_pos = START_POSITIONS[map_number]
+        actions = random_actions(100, 100, seed)
+
+        for geometry in GEOMETRIES:
+            session = SimulationSession(f"maps/map{map_number}.png", WIDTH, HEIGHT, BORDER_COLOR, start_pos, MAX_STEPS,
+                                        MAX_DISTANCE, (CAR_SIZE_X, CAR_SIZE_Y), geometry=geometry)
+            track = session.track
+            snapshots = drive_fleet(track, start_pos, actions)
+            fleet = CarFleet(100, track.width, track.height, MAX_DISTANCE, start_pos, CAR_SIZE_X, CAR_SIZE_Y)
+
+            prefix = f"map{map_number}/{geometry}"
+            cases[f"{prefix}/cast_rays"] = ("rays", bench_cast_rays, track, snapshots)
+            cases[f"{prefix}/box_hits"] = ("car-steps", bench_box_hits, track, snapshots)
+            cases[f"{prefix}/sweep"] = ("corners", bench_sweep, track, snapshots)
+            cases[f"{prefix}/fleet_update"] = ("car-steps", bench_fleet_update, track, fleet, actions)
+            for pop_size in pop_sizes:
+                cases[f"{prefix}/generation[{pop_size}]"] = \
+                    ("car-steps", bench_generation, session, seeded_genomes(config, pop_size, seed), config)
+
+        # The legacy Car only reads pixels, so it runs on the raster track
+        session = SimulationSession(f"maps/map{map_number}.png", WIDTH, HEIGHT, BORDER_COLOR, start_pos, MAX_STEPS,
+                                    MAX_DISTANCE, (CAR_SIZE_X, CAR_SIZE_Y))
+        legacy = drive_cars(session.track, start_pos, 100, 100, seed)
+        car = Car(WIDTH, HEIGHT, MAX_DISTANCE, start_pos, CAR_SIZE_X, CAR_SIZE_Y, BORDER_COLOR)
+        cases[f"map{map_number}/legacy/check_radar"] = ("car-steps", bench_check_radar, session.track, legacy, car)
+        cases[f"map{map_number}/legacy/check_collision"] = \
+            ("car-steps", bench_check_collision, session.track, legacy, car)
+        cases[f"map{map_number}/legacy/update"] = ("car-steps", bench_update, session.track, legacy, car)
+
+    for name, (unit, function, *args) in cases.items():
+        results[name] = measure(function, *args, repeat=repeat)
+        print(f"{name:40} {results[name]['throughput']:14,.0f} {unit + '/s':13} {results[name]['peak_kib']:10,.0f} KiB")
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Print how every result moved against the baseline, returns True if anything got slower than tolerance allows
+    regressed = False
+    print(f"\n{'benchmark':40} {'speed':>8} {'memory':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        speed = result["throughput"] / baseline[name]["throughput"]
+        memory = result["peak_kib"] / max(baseline[name]["peak_kib"], 1)
+        flag = ""
+        if speed < 1 - tolerance:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{name:40} {speed:7.2f}x {memory:7.2f}x{flag}")
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot paths on the bundled maps")
+    parser.add_argument("--maps", type=int, nargs="+", default=sorted(START_POSITIONS), metavar="N")
+    parser.add_argument("--pop-sizes", type=int, nargs="+", default=[100, 500, 1000], metavar="N")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, the best one counts")
+    parser.add_argument("--save", metavar="FILE", help="store the results as a baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="fraction of throughput that may be lost before it counts as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.maps, args.pop_sizes, args.seed, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
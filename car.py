@@ -1,5 +1,6 @@
 import pygame
 import math
+from sprites import car_atlas
 
 
 class Car:
@@ -14,10 +15,6 @@ class Car:
         self.width = width
         self.height = height
 
-        self.sprite = pygame.image.load('car.png').convert()
-        self.sprite = pygame.transform.scale(self.sprite, (size_x, size_y))
-        self.rotated_sprite = self.sprite
-
         self.position = pygame.Vector2(start_pos)
         self.angle = 0
         self.speed = 0
@@ -37,35 +34,31 @@ class Car:
         self.border_color = border_color
 
     def draw(self, screen):
-        screen.blit(self.rotated_sprite, self.position)
-        self.draw_radar(screen)
+        # Returns the rectangles drawn on
+        rects = [screen.blit(car_atlas(self.size_x, self.size_y).get(self.angle), self.position)]
+        return rects + self.draw_radar(screen)
 
     def draw_radar(self, screen):
+        rects = []
         for radar in self.radars:
             position = radar[0]
-            pygame.draw.line(screen, (0, 255, 0), self.center, position, 1)
-            pygame.draw.circle(screen, (0, 255, 0), position, 5)
+            rects.append(pygame.draw.line(screen, (0, 255, 0), self.center, position, 1))
+            rects.append(pygame.draw.circle(screen, (0, 255, 0), position, 5))
+        return rects
 
     def check_collision(self, game_map):
         self.alive = True
         for point in self.corners:
             int_point = (int(point[0]), int(point[1]))
-            if self.point_inbounds(int_point) and game_map.get_at(int_point) == self.border_color:
+            if self.point_inbounds(int_point) and game_map.walls[int_point]:
                 self.alive = False
                 break
 
     def check_radar(self, degree, game_map):
-        x, y = self.center[0], self.center[1]
-
         # Get the angle in radians
         angle_rad = math.radians(360 - (self.angle + degree))
 
-        for length in range(1, self.max_distance + 1):
-            if game_map.get_at((int(x), int(y))) == self.border_color:
-                break
-
-            x = self.center[0] + math.cos(angle_rad) * length
-            y = self.center[1] + math.sin(angle_rad) * length
+        x, y = game_map.cast_ray(self.center, angle_rad, self.max_distance)
 
         dist = int(math.sqrt((x - self.center[0]) ** 2 + (y - self.center[1]) ** 2))
         self.radars.append([(x, y), dist])
@@ -75,7 +68,6 @@ class Car:
             self.speed = 20
             self.speed_set = True
 
-        self.rotated_sprite = self.rotate_center(self.sprite, self.angle)
         self.position[0] += math.cos(math.radians(360 - self.angle)) * self.speed
         self.position[0] = max(self.position[0], 20)
         self.position[0] = min(self.position[0], self.width - 120)
@@ -122,13 +114,5 @@ class Car:
         # Criteria: speed, distance, no crash
         return self.distance * self.speed  # i added speed here
 
-    def rotate_center(self, image, angle):
-        rectangle = image.get_rect()
-        rotated_image = pygame.transform.rotate(image, angle)
-        rotated_rectangle = rectangle.copy()
-        rotated_rectangle.center = rotated_image.get_rect().center
-        rotated_image = rotated_image.subsurface(rotated_rectangle).copy()
-        return rotated_image
-
     def point_inbounds(self, point):
         return 0 < point[0] < self.width and 0 < point[1] < self.height
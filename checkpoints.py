@@ -0,0 +1,132 @@
+import json
+import os
+from collections import deque
+import numpy as np
+
+# Cars pass a checkpoint by getting within this many pixels of it (at 1920x1060)
+CHECKPOINT_RADIUS = 80
+
+# Maps of other widths, like the downscaled ones used for screening, scale the radius along
+CHECKPOINT_MAP_WIDTH = 1920
+
+
+def sidecar_path(map_path):
+    # maps/map3.png -> maps/map3.json
+    return os.path.splitext(map_path)[0] + ".json"
+
+
+def load_checkpoints(map_path):
+    # Checkpoints in driving order as (x, y) pixels of the map image, like draw_map returns them
+    path = sidecar_path(map_path)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [tuple(point) for point in json.load(f)]
+
+
+def save_checkpoints(map_path, checkpoints):
+    with open(sidecar_path(map_path), "w") as f:
+        json.dump([list(point) for point in checkpoints], f)
+
+
+def checkpoint_radius(width):
+    return CHECKPOINT_RADIUS * width / CHECKPOINT_MAP_WIDTH
+
+
+def checkpoint_raster(walls, checkpoints, radius):
+    # Id of the nearest checkpoint within radius for every open pixel, -1 everywhere else.
+    # Lets every car find out which checkpoint it is at with a single lookup per step
+    width, height = walls.shape
+    ids = np.full((width, height), -1, dtype=np.int16)
+    best = np.full((width, height), np.inf)
+
+    r = int(np.ceil(radius))
+    for i, (cx, cy) in enumerate(checkpoints):
+        x0, x1 = max(int(cx) - r, 0), min(int(cx) + r + 1, width)
+        y0, y1 = max(int(cy) - r, 0), min(int(cy) + r + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+
+        xs, ys = np.ogrid[x0:x1, y0:y1]
+        dist_sq = (xs - cx) ** 2 + (ys - cy) ** 2
+        closer = (dist_sq <= radius ** 2) & (dist_sq < best[x0:x1, y0:y1])
+        best[x0:x1, y0:y1][closer] = dist_sq[closer]
+        ids[x0:x1, y0:y1][closer] = i
+
+    ids[np.asarray(walls)] = -1
+    return ids
+
+
+def trace_checkpoints(track, start_pos, size, spacing=150, cell=4):
+    # Lay checkpoints along the track, in driving order starting from a car at start_pos
+    # facing right: block the track just behind the car, find the shortest way around
+    # the lap on a coarse grid, and drop a checkpoint every spacing pixels along it,
+    # moved to the middle of the track
+    start = (int(start_pos[0] + size[0] / 2) // cell, int(start_pos[1] + size[1] / 2) // cell)
+
+    # A cell is open if there is enough room around it for a car
+    width, height = track.width // cell, track.height // cell
+    clearance = np.asarray(track.distance)[:width * cell, :height * cell]
+    open_cells = clearance.reshape(width, cell, height, cell).min(axis=(1, 3)) > max(size) / 2
+
+    # Wall off the track right behind the start so the search has to go around the lap
+    barrier_x = start[0] - 2
+    top = bottom = start[1]
+    while top > 0 and open_cells[barrier_x, top - 1]:
+        top -= 1
+    while bottom < height - 1 and open_cells[barrier_x, bottom + 1]:
+        bottom += 1
+    open_cells[barrier_x, top:bottom + 1] = False
+    goal = (barrier_x - 1, start[1])
+
+    came_from = {start: None}
+    queue = deque([start])
+    while queue and goal not in came_from:
+        x, y = queue.popleft()
+        for step in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if 0 <= step[0] < width and 0 <= step[1] < height and open_cells[step] and step not in came_from:
+                came_from[step] = (x, y)
+                queue.append(step)
+
+    if goal not in came_from:
+        raise ValueError("Could not find a way around the track from the start position")
+
+    path = [goal]
+    while came_from[path[-1]] is not None:
+        path.append(came_from[path[-1]])
+    path = np.array(path[::-1]) * cell + cell / 2
+
+    travelled = np.concatenate([[0], np.cumsum(np.hypot(*np.diff(path, axis=0).T))])
+    checkpoints = []
+    for mark in np.arange(spacing, travelled[-1], spacing):
+        x, y = path[np.searchsorted(travelled, mark)]
+
+        # Move to the point furthest from any wall close by, without crossing a wall to get there
+        x0, y0 = max(int(x) - spacing // 4, 0), max(int(y) - spacing // 4, 0)
+        window = clearance[x0:int(x) + spacing // 4, y0:int(y) + spacing // 4]
+        for flat in np.argsort(window, axis=None)[::-1]:
+            dx, dy = np.unravel_index(flat, window.shape)
+            line = np.linspace((x, y), (x0 + dx, y0 + dy), 16).astype(int)
+            if np.all(clearance[line[:, 0], line[:, 1]] > 0):
+                break
+        checkpoints.append((x0 + int(dx), y0 + int(dy)))
+
+    return checkpoints
+
+
+if __name__ == "__main__":
+    # Generate the checkpoint files of the bundled maps
+    import pygame
+    from constants import START_POSITIONS
+    from track import Track
+
+    for map_number, start_pos in START_POSITIONS.items():
+        map_path = f"maps/map{map_number}.png"
+        track = Track.load(map_path, 1920, 1060, (255, 255, 255, 255), cache_dir=None)
+        checkpoints = trace_checkpoints(track, start_pos, (20, 20))
+
+        # Stored in pixels of the map image, like the checkpoints of a custom map
+        image_width, image_height = pygame.image.load(map_path).get_size()
+        scale_x, scale_y = image_width / track.width, image_height / track.height
+        save_checkpoints(map_path, [(round(x * scale_x), round(y * scale_y)) for x, y in checkpoints])
+        print(f"Map {map_number}: {len(checkpoints)} checkpoints")
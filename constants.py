@@ -3,6 +3,9 @@ HEIGHT = 1060
 FPS = 60
 MAP_NUMBER = 6
 
+# Where the cars start (top left corner of the car) on each of the bundled maps
+START_POSITIONS = {1: [990, 917], 2: [830, 870], 3: [830, 870], 4: [820, 893], 5: [820, 884], 6: [820, 872]}
+
 CAR_SIZE_X = 20
 CAR_SIZE_Y = 20
 
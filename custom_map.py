@@ -3,8 +3,10 @@ import os
 import neat
 import pygame
 import sys
-from time import time
-from car import Car
+from functools import partial
+from checkpoints import save_checkpoints
+from network import BatchNetwork
+from session import SimulationSession
 
 WIDTH = 1920
 HEIGHT = 1060
@@ -19,8 +21,12 @@ MAX_DISTANCE = 300
 
 START_POS = [830, 870]
 
-# File to store the best model
+# Simulation steps per generation (10 seconds at 60 FPS)
+MAX_STEPS = 600
+
+# File to store the best model, and the file its network is exported to for custom_test.py
 MODEL_FILE = "genomes/best_genome.pkl"
+EXPORT_FILE = "genomes/best_genome.npz"
 
 config_path = "./config.txt"
 
@@ -72,6 +78,7 @@ def draw_map():
                         print("Please set a starting position before saving.")
                     else:
                         pygame.image.save(map_surface, "custom_map.png")
+                        save_checkpoints("custom_map.png", checkpoints)
                         print("Map saved as 'custom_map.png'. Starting simulation...")
                         running = False
                 if event.key == pygame.K_p:
@@ -98,69 +105,13 @@ def draw_map():
     return start_pos, checkpoints
 
 
-def run_simulation(genomes, config):
-    nets = []
-    cars = []
-
-    pygame.init()
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    pygame.display.set_caption("AI Cars")
-
-    for i, g in genomes:
-        net = neat.nn.FeedForwardNetwork.create(g, config)
-        nets.append(net)
-        g.fitness = 0
-        cars.append(Car(WIDTH, HEIGHT, MAX_DISTANCE, start_pos, CAR_SIZE_X, CAR_SIZE_Y, BORDER_COLOR))
-
-    clock = pygame.time.Clock()
-    raw_map = pygame.image.load("custom_map.png")
-    game_map = pygame.transform.scale(raw_map, (WIDTH, HEIGHT)).convert()
-
+def run_simulation(genomes, config, session):
     global current_generation
     current_generation += 1
 
-    start = time()
-
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                sys.exit()
-
-        for i, car in enumerate(cars):
-            output = nets[i].activate(car.get_data())
-            choice = output.index(max(output))
-            if choice == 0:
-                car.angle += 10  # Left
-            elif choice == 1:
-                car.angle -= 10  # Right
-            elif choice == 2:
-                if car.speed >= 14:
-                    car.speed -= 2  # Slow down
-            else:
-                car.speed += 2  # Speed up
-
-        still_alive = 0
-        for i, car in enumerate(cars):
-            if car.is_alive():
-                still_alive += 1
-                car.update(game_map)
-                genomes[i][1].fitness += car.get_reward()
-            else:
-                genomes[i][1].fitness *= 0.5
-
-        if still_alive == 0 or time() - start > 10:
-            running = False
-
-        screen.blit(game_map, (0, 0))
-        for car in cars:
-            if car.is_alive():
-                car.draw(screen)
-
-        pygame.display.flip()
-        clock.tick(60)
-
-    pygame.quit()
+    fitness = session.run_generation([g for _, g in genomes], config, current_generation)
+    for i, (_, g) in enumerate(genomes):
+        g.fitness = float(fitness[i])
 
 
 if __name__ == "__main__":
@@ -186,8 +137,15 @@ if __name__ == "__main__":
     stats = neat.StatisticsReporter()
     population.add_reporter(stats)
 
-    winner = population.run(run_simulation, 1000)
+    # Set up the window and map once for all generations
+    session = SimulationSession("custom_map.png", WIDTH, HEIGHT, BORDER_COLOR, start_pos, MAX_STEPS, MAX_DISTANCE,
+                                (CAR_SIZE_X, CAR_SIZE_Y))
+    try:
+        winner = population.run(partial(run_simulation, session=session), 1000)
+    finally:
+        session.close()
 
     with open(MODEL_FILE, "wb") as f:
         pickle.dump(winner, f)
+    BatchNetwork.create([winner], config).save(EXPORT_FILE)
     print("Best genome saved.")
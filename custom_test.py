@@ -1,10 +1,15 @@
+import argparse
 import pickle
 import os
-import neat
+import numpy as np
 import pygame
 import sys
-from time import time
-from car import Car
+from checkpoints import save_checkpoints
+from constants import SPEED_MULTIPLIER
+from env import CarEnv
+from network import BatchNetwork
+from render import RenderPolicy
+from track import Track
 
 WIDTH = 1920
 HEIGHT = 1060
@@ -17,11 +22,27 @@ TRACK_COLOR = (0, 0, 0, 255)  # Black
 
 MAX_DISTANCE = 300
 
-# File to load the model from
-MODEL_FILE = "genomes/best_genome.pkl"
+# Ticks simulated per frame while skipping ahead, small enough to keep the window responsive
+SKIP_BURST = 1000
+
+# File to load the model from, made by export_model.py (and by train.py along with the genome)
+MODEL_FILE = "genomes/best_genome.npz"
+GENOME_FILE = "genomes/best_genome.pkl"
 config_path = "./config.txt"
 
 
+def load_network(path):
+    # Exported networks load without neat, pickled genomes still need it
+    if not path.endswith(".pkl"):
+        return BatchNetwork.load(path)
+
+    import neat
+    config = neat.config.Config(neat.DefaultGenome, neat.DefaultReproduction, neat.DefaultSpeciesSet,
+                                neat.DefaultStagnation, config_path)
+    with open(path, "rb") as f:
+        return BatchNetwork.create([pickle.load(f)], config)
+
+
 def draw_map():
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
@@ -67,6 +88,7 @@ def draw_map():
                         print("Please set a starting position before saving.")
                     else:
                         pygame.image.save(map_surface, "custom_map.png")
+                        save_checkpoints("custom_map.png", checkpoints)
                         print("Map saved as 'custom_map.png'. Starting simulation...")
                         running = False
                 if event.key == pygame.K_p:
@@ -93,21 +115,48 @@ def draw_map():
     return start_pos, checkpoints
 
 
-def test_model(genome, config, start_pos):
+def report_progress(fleet, checkpoint_count, laps, stopped):
+    # Print every lap finished and every car taken off the track since the last call, in simulated ticks.
+    # stopped holds the cars already reported
+    if checkpoint_count:
+        finished = fleet.checkpoints_passed // checkpoint_count
+        for i in np.flatnonzero(finished > laps):
+            print(f"Car {i + 1} finished lap {finished[i]} at tick {fleet.time[i]}")
+        laps[:] = finished
+
+    for i in np.flatnonzero(~fleet.alive & ~stopped):
+        if fleet.stalled[i]:
+            print(f"Car {i + 1} stalled after {fleet.time[i]} ticks")
+        else:
+            print(f"Car {i + 1} crashed after {fleet.time[i]} ticks")
+    stopped[:] = ~fleet.alive
+
+
+def test_model(network, start_pos, policy=None, speed=SPEED_MULTIPLIER, skip_to=0, max_ticks=None):
+    # One car for every network in the batch, all racing on the same map. speed simulation
+    # ticks are run for every frame drawn, and nothing is drawn before tick skip_to
+    if policy is None:
+        policy = RenderPolicy()
+
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption("Testing AI Car")
 
-    # Create neural network from genome
-    net = neat.nn.FeedForwardNetwork.create(genome, config)
-    car = Car(WIDTH, HEIGHT, MAX_DISTANCE, start_pos, CAR_SIZE_X, CAR_SIZE_Y, BORDER_COLOR)
-
     clock = pygame.time.Clock()
-    raw_map = pygame.image.load("custom_map.png")
-    game_map = pygame.transform.scale(raw_map, (WIDTH, HEIGHT)).convert()
+    game_map = Track.load("custom_map.png", WIDTH, HEIGHT, BORDER_COLOR)
+    checkpoint_count = 0 if game_map.checkpoints is None else len(game_map.checkpoints)
+
+    # Drives until every car crashed or stalled, or for max_ticks ticks
+    count = len(network.biases)
+    env = CarEnv(game_map, count, start_pos, MAX_DISTANCE, (CAR_SIZE_X, CAR_SIZE_Y), max_ticks)
+    obs = env.reset()
+    done = False
+    laps = np.zeros(count, dtype=np.int64)
+    stopped = np.zeros(count, dtype=bool)
 
     running = True
     printed = False
+    frames = 0
 
     while running:
         for event in pygame.event.get():
@@ -118,61 +167,76 @@ def test_model(genome, config, start_pos):
             # Add reset functionality with R key
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_r:
-                    car = Car(WIDTH, HEIGHT, MAX_DISTANCE, start_pos, CAR_SIZE_X, CAR_SIZE_Y, BORDER_COLOR)
-                    start = time()
-
-        # Get network output and control car
-        output = net.activate(car.get_data())
-        choice = output.index(max(output))
-
-        if choice == 0:
-            car.angle += 10  # Left
-        elif choice == 1:
-            car.angle -= 10  # Right
-        elif choice == 2:
-            if car.speed >= 14:
-                car.speed -= 2  # Slow down
-        else:
-            car.speed += 2  # Speed up
-
-        # Update car state
-        if car.is_alive():
-            car.update(game_map)
+                    obs = env.reset()
+                    done = False
+                    laps[:] = 0
+                    stopped[:] = False
+                    frames = 0
+
+        # Get network output and control the cars, a burst of ticks at a time
+        skipping = env.steps < skip_to
+        ticks = min(skip_to - env.steps, SKIP_BURST) if skipping else speed
+        for _ in range(ticks):
+            if done:
+                break
+            alive = ~env.dones
+            actions = np.full(count, -1)
+            actions[alive] = network.choose(obs[alive], alive)
+            obs, _, dones = env.step(actions)
+            done = dones.all()
             printed = False
-        elif not printed:
-            print("Car crashed! Press R to reset or close window to exit.")
+            report_progress(env.fleet, checkpoint_count, laps, stopped)
+
+        if done and not printed:
+            if env.fleet.alive.any():
+                print(f"Stopped at tick {env.steps}, {int(env.fleet.alive.sum())} of {count} cars still driving.")
+            print(f"Longest survival: {env.fleet.time.max()} ticks. Press R to reset or close window to exit.")
             printed = True
 
-        # Draw everything
-        screen.blit(game_map, (0, 0))
-        if car.is_alive():
-            car.draw(screen)
+        # Draw everything (or only every policy.every frames)
+        frames += 1
+        if (skipping and not done) or not policy.due(frames):
+            continue
 
-        pygame.display.flip()
-        clock.tick(60)
+        policy.clear(screen, game_map.surface)
+        rects = env.fleet.draw(screen)
 
+        policy.show(rects)
+        clock.tick(policy.fps)
 
 if __name__ == "__main__":
-    if not os.path.exists(MODEL_FILE):
-        print(f"Error: No trained model found at {MODEL_FILE}")
-        sys.exit(1)
-
-    # Load Config
-    config = neat.config.Config(
-        neat.DefaultGenome,
-        neat.DefaultReproduction,
-        neat.DefaultSpeciesSet,
-        neat.DefaultStagnation,
-        config_path
-    )
-
-    # Load the trained model
-    with open(MODEL_FILE, "rb") as f:
-        best_genome = pickle.load(f)
-        print("Loaded trained model successfully.")
+    parser = argparse.ArgumentParser(description="Test the trained model on a map you draw")
+    parser.add_argument("models", nargs="*", default=[MODEL_FILE], metavar="MODEL",
+                        help="exported networks (or pickled genomes) to race against each other")
+    parser.add_argument("--render-every", type=int, default=1, metavar="N",
+                        help="only draw every Nth simulation step")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only redraw the parts of the screen the car moved over")
+    parser.add_argument("--speed", type=int, default=SPEED_MULTIPLIER, metavar="N",
+                        help="simulate N ticks for every frame drawn")
+    parser.add_argument("--skip-to", type=int, default=0, metavar="TICK",
+                        help="simulate without drawing anything until tick TICK")
+    parser.add_argument("--max-ticks", type=int, metavar="TICK",
+                        help="stop the cars after TICK ticks")
+    args = parser.parse_args()
+
+    for path in args.models:
+        if not os.path.exists(path):
+            print(f"Error: No trained model found at {path}")
+            sys.exit(1)
+
+    # A genome saved by something that didn't export it is newer than the exported network
+    if args.models == [MODEL_FILE] and os.path.exists(GENOME_FILE) and \
+            os.path.getmtime(GENOME_FILE) > os.path.getmtime(MODEL_FILE):
+        print(f"Warning: {GENOME_FILE} is newer than {MODEL_FILE}, run export_model.py to test the newer one")
+
+    # Load the trained models
+    network = BatchNetwork.stack([load_network(path) for path in args.models])
+    print("Loaded trained model successfully.")
 
     # Let user draw the map and get starting position
     start_pos, checkpoints = draw_map()
 
     # Test the model
-    test_model(best_genome, config, start_pos)
\ No newline at end of file
+    test_model(network, start_pos, RenderPolicy(args.render_every, dirty_rects=args.dirty_rects), max(1, args.speed),
+               args.skip_to, args.max_ticks)
\ No newline at end of file
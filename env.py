@@ -0,0 +1,45 @@
+import numpy as np
+from fleet import CarFleet
+from telemetry import NULL_PROFILER
+
+
+class CarEnv:
+    # N cars driving on one track, stepped together. Controllers only ever see arrays:
+    #   obs = env.reset()                          (N, 5) radar readings
+    #   obs, rewards, dones = env.step(actions)    actions are 0 left, 1 right, 2 slow down, 3 speed up
+    # Cars that are done ignore their actions and earn nothing. Nothing here draws,
+    # the fleet can be drawn separately if someone is watching
+
+    def __init__(self, track, count, start_pos, max_distance, car_size, max_steps=None, profiler=NULL_PROFILER,
+                 scale=1):
+        self.track = track
+        self.count = count
+        self.max_steps = max_steps  # None to keep going until every car crashed
+        self.profiler = profiler
+
+        # start_pos, max_distance and car_size are in full size pixels, scale says how big the track is
+        self.fleet = CarFleet(count, track.width, track.height, max_distance, start_pos, *car_size, scale=scale)
+        self.steps = 0
+        self.dones = np.zeros(count, dtype=bool)
+
+    def reset(self):
+        self.fleet.reset()
+        self.steps = 0
+        self.dones = np.zeros(self.count, dtype=bool)
+        return self.observe()
+
+    def observe(self):
+        return self.fleet.get_data()
+
+    def step(self, actions):
+        active = ~self.dones
+        self.fleet.apply_actions(np.where(active, actions, -1))
+        self.fleet.update(self.track, self.profiler)
+        self.steps += 1
+
+        rewards = np.where(active, self.fleet.get_rewards(), 0)
+        self.dones = ~self.fleet.alive
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            self.dones[:] = True
+
+        return self.observe(), rewards, self.dones.copy()
@@ -0,0 +1,30 @@
+import argparse
+import pickle
+import neat
+from network import BatchNetwork
+
+# Trained genome, and the file its network is exported to
+MODEL_FILE = "genomes/best_genome.pkl"
+EXPORT_FILE = "genomes/best_genome.npz"
+config_path = "./config.txt"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained genome as a network that runs without neat")
+    parser.add_argument("model", nargs="?", default=MODEL_FILE, help="pickled genome to export")
+    parser.add_argument("output", nargs="?", default=EXPORT_FILE, help=".npz file to write")
+    args = parser.parse_args()
+
+    config = neat.config.Config(neat.DefaultGenome,
+                                neat.DefaultReproduction,
+                                neat.DefaultSpeciesSet,
+                                neat.DefaultStagnation,
+                                config_path)
+
+    with open(args.model, "rb") as f:
+        genome = pickle.load(f)
+
+    network = BatchNetwork.create([genome], config)
+    network.save(args.output)
+    print(f"Exported {args.model} to {args.output} ({network.biases.shape[1]} nodes, "
+          f"{int((network.weights != 0).sum())} connections)")
@@ -0,0 +1,249 @@
+import numpy as np
+import pygame
+from constants import CHECKPOINT_REWARD
+from sprites import car_atlas
+from telemetry import NULL_PROFILER
+
+# Radar directions relative to the car, same as Car.update
+RADAR_DEGREES = np.arange(-90, 120, 45)
+
+# Corner directions relative to the car, same as Car.update
+CORNER_DEGREES = np.array([30, 150, 210, 330])
+
+# A car that moved less than STALL_DISTANCE pixels over the last STALL_WINDOW steps is
+# taken off the track. Steering the same way every step takes a car around a full
+# circle in 36 steps, so that window catches spinning cars as well as stuck ones
+STALL_WINDOW = 36
+STALL_DISTANCE = 100
+
+# A car that cuts a corner can miss a checkpoint, reaching one of the next few still counts.
+# Never more than all the other checkpoints, the one a car just passed is always behind it
+CHECKPOINT_LOOKAHEAD = 3
+
+
+class CarFleet:
+    # Every car of a generation stored as NumPy arrays, so the whole population
+    # moves, collides and senses in a handful of batched operations
+
+    def __init__(self, count, width, height, max_distance, start_pos, size_x, size_y,
+                 stall_window=STALL_WINDOW, stall_distance=STALL_DISTANCE, swept=True, scale=1):
+        self.count = count
+        self.max_distance = max_distance
+
+        # Size of the track relative to the full size map (0.5 for half the resolution).
+        # Everything is given in full size pixels and scaled down here, speeds and radar
+        # distances stay in full size pixels, so the cars see and earn the same numbers
+        self.scale = scale
+
+        # Check the whole way every corner moved for walls, not just where it ended up
+        self.swept = swept
+
+        # Set stall_window to 0 to never take cars off for not making progress
+        self.stall_window = stall_window
+        self.stall_distance = stall_distance
+
+        self.size_x = size_x * scale
+        self.size_y = size_y * scale
+
+        # Note this is screen sizes
+        self.width = width
+        self.height = height
+
+        self.start_pos = (start_pos[0] * scale, start_pos[1] * scale)
+        self.reset()
+
+    def reset(self):
+        # Put every car back at the start, ready for the next generation
+        count = self.count
+
+        self.position = np.tile(np.array(self.start_pos, dtype=np.float64), (count, 1))
+        self.angle = np.zeros(count, dtype=np.int64)
+        self.speed = np.zeros(count, dtype=np.int64)
+
+        self.speed_set = np.zeros(count, dtype=bool)
+
+        self.center = self.position + (self.size_x / 2, self.size_y / 2)  # Calculate Center
+
+        self.radars = np.zeros((count, len(RADAR_DEGREES), 2))
+        self.radar_dists = np.zeros((count, len(RADAR_DEGREES)), dtype=np.int64)
+
+        self.alive = np.ones(count, dtype=bool)
+        self.stalled = np.zeros(count, dtype=bool)
+
+        # Centers of the last stall_window steps, the one from step t is kept in row t % stall_window
+        self.history = np.zeros((self.stall_window, count, 2))
+        if self.stall_window:
+            self.history[0] = self.center
+
+        self.distance = np.zeros(count, dtype=np.int64)
+        self.time = np.zeros(count, dtype=np.int64)
+
+        # Index of the checkpoint each car has to reach next, and how many it reached so far (over all laps)
+        self.next_checkpoint = np.zeros(count, dtype=np.int64)
+        self.checkpoints_passed = np.zeros(count, dtype=np.int64)
+
+        # Checkpoint each car was at on the last step (-1 for none), it has to leave before it counts again
+        self.at_checkpoint = np.full(count, -1, dtype=np.int64)
+
+        # Reward every car earned on the last step
+        self.reward = np.zeros(count, dtype=np.int64)
+
+    def apply_actions(self, choices):
+        self.angle[choices == 0] += 10  # Left
+        self.angle[choices == 1] -= 10  # Right
+        self.speed[(choices == 2) & (self.speed >= 14)] -= 2  # Slow down
+        self.speed[choices == 3] += 2  # Speed up
+
+    def update(self, track, profiler=NULL_PROFILER):
+        moving = np.flatnonzero(self.alive)
+        if not moving.size:
+            return
+
+        with profiler.phase("physics"):
+            first = moving[~self.speed_set[moving]]
+            self.speed[first] = 20
+            self.speed_set[first] = True
+
+            previous = self.center[moving]
+
+            speed = self.speed[moving]
+            heading = np.radians(360 - self.angle[moving])
+            x = self.position[moving, 0] + np.cos(heading) * speed * self.scale
+            x = np.minimum(np.maximum(x, 20 * self.scale), self.width - 120 * self.scale)
+            y = self.position[moving, 1] + np.sin(heading) * speed * self.scale
+            y = np.minimum(np.maximum(y, 20 * self.scale), self.width - 120 * self.scale)
+            self.position[moving, 0] = x
+            self.position[moving, 1] = y
+
+            self.distance[moving] += speed
+            self.time[moving] += 1
+
+            center = np.trunc(self.position[moving]) + (self.size_x / 2, self.size_y / 2)
+            self.center[moving] = center
+
+        with profiler.phase("collision"):
+            self.check_collision(moving, center, track, previous if self.swept else None)
+        with profiler.phase("radar"):
+            self.check_radar(moving, center, track)
+        if self.stall_window:
+            with profiler.phase("progress"):
+                self.check_progress(moving, center)
+
+        with profiler.phase("checkpoints"):
+            self.reward[:] = 0
+            if track.checkpoints is None:
+                # Criteria: speed, distance, no crash
+                self.reward[moving] = self.distance[moving] * speed
+            else:
+                # Reaching checkpoints in order is what counts, speed only breaks ties
+                passed = self.check_checkpoints(moving, center, track)
+                self.reward[moving] = passed * CHECKPOINT_REWARD + speed
+
+    def corners(self, moving, center):
+        # Corners of every moving car around the given centers, shape (cars, 4)
+        length = 0.5 * self.size_x
+        corner_rad = np.radians(360 - (self.angle[moving, None] + CORNER_DEGREES))
+        return center[:, 0, None] + np.cos(corner_rad) * length, center[:, 1, None] + np.sin(corner_rad) * length
+
+    def check_collision(self, moving, center, track, previous=None):
+        corner_x, corner_y = self.corners(moving, center)
+        hit = track.box_hits(corner_x, corner_y)
+
+        # A fast car can jump over a thin wall in a single step, so also follow
+        # every corner from where it was at the previous center
+        if previous is not None:
+            start_x, start_y = self.corners(moving, previous)
+            hit |= track.sweep(start_x.ravel(), start_y.ravel(), corner_x.ravel(), corner_y.ravel()).reshape(hit.shape)
+
+        self.alive[moving] = ~hit.any(axis=1)
+
+    def check_radar(self, moving, center, track):
+        ray_rad = np.radians(360 - (self.angle[moving, None] + RADAR_DEGREES))
+        origin_x = np.repeat(center[:, 0], len(RADAR_DEGREES))
+        origin_y = np.repeat(center[:, 1], len(RADAR_DEGREES))
+
+        x, y = track.cast_rays(origin_x, origin_y, ray_rad.ravel(), int(round(self.max_distance * self.scale)))
+        dist = (np.sqrt((x - origin_x) ** 2 + (y - origin_y) ** 2) / self.scale).astype(np.int64)
+
+        self.radars[moving] = np.stack((x, y), axis=1).reshape(-1, len(RADAR_DEGREES), 2)
+        self.radar_dists[moving] = dist.reshape(-1, len(RADAR_DEGREES))
+
+    def check_progress(self, moving, center):
+        # Compare with where each car was stall_window steps ago, then remember where it is now
+        time = self.time[moving]
+        slot = time % self.stall_window
+        displacement = np.hypot(*(center - self.history[slot, moving]).T)
+        stalled = (time >= self.stall_window) & (displacement < self.stall_distance * self.scale) & self.alive[moving]
+        self.history[slot, moving] = center
+
+        self.stalled[moving[stalled]] = True
+        self.alive[moving[stalled]] = False
+
+    def check_checkpoints(self, moving, center, track):
+        # Returns how many checkpoints each car just reached
+        reached = track.checkpoint_at(center[:, 0], center[:, 1])
+
+        count = len(track.checkpoints)
+        lookahead = min(CHECKPOINT_LOOKAHEAD, max(count - 1, 1))
+        ahead = (reached - self.next_checkpoint[moving]) % count
+        entered = (reached >= 0) & (reached != self.at_checkpoint[moving])
+        passed = np.where(entered & (ahead < lookahead), ahead + 1, 0)
+        self.at_checkpoint[moving] = reached
+
+        self.next_checkpoint[moving] = (self.next_checkpoint[moving] + passed) % count
+        self.checkpoints_passed[moving] += passed
+        return passed
+
+    def get_data(self):
+        return self.radar_dists // 30
+
+    def get_rewards(self):
+        return self.reward
+
+    def draw(self, screen, rows=None):
+        # Draws the given cars (all living ones by default), returns the rectangles drawn on
+        if rows is None:
+            rows = np.flatnonzero(self.alive)
+
+        atlas = car_atlas(self.size_x, self.size_y)
+        rects = []
+        for i in rows:
+            rects.append(screen.blit(atlas.get(self.angle[i]), self.position[i]))
+            rects.extend(self.draw_radar(screen, i))
+        return rects
+
+    def draw_radar(self, screen, i):
+        rects = []
+        for position in self.radars[i]:
+            rects.append(pygame.draw.line(screen, (0, 255, 0), self.center[i], position, 1))
+            rects.append(pygame.draw.circle(screen, (0, 255, 0), position, 5))
+        return rects
+
+
+if __name__ == "__main__":
+    # Drive one car straight through maps with very few checkpoints: every checkpoint has to
+    # count exactly once, however long the car stays inside it
+    import os
+    import tempfile
+    from checkpoints import save_checkpoints
+    from env import CarEnv
+    from track import Track
+
+    for checkpoints, expected in (([(400, 510)], 1), ([(400, 510), (700, 510), (1000, 510)], 3)):
+        with tempfile.TemporaryDirectory() as directory:
+            map_path = os.path.join(directory, "straight.png")
+            surface = pygame.Surface((1920, 1060))
+            surface.fill((0, 0, 0))
+            pygame.draw.rect(surface, (255, 255, 255), surface.get_rect(), 10)
+            pygame.image.save(surface, map_path)
+            save_checkpoints(map_path, checkpoints)
+
+            track = Track.load(map_path, 1920, 1060, (255, 255, 255, 255), cache_dir=None)
+            env = CarEnv(track, 1, (100, 500), 300, (20, 20))
+            env.reset()
+            for _ in range(50):
+                env.step([-1])
+
+        passed = int(env.fleet.checkpoints_passed[0])
+        print(f"{len(checkpoints)} checkpoint(s): passed {passed}, center now at x {env.fleet.center[0, 0]:.0f}")
+        assert env.fleet.alive[0] and passed == expected, "A checkpoint was counted more or less than once"
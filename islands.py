@@ -0,0 +1,219 @@
+import multiprocessing
+import os
+import queue
+import random
+import neat
+import numpy as np
+from collections import defaultdict
+from itertools import count
+from constants import START_POSITIONS
+from memo import FitnessCache
+from session import SimulationSession
+from simulation import combined_fitness
+from snapshots import Snapshotter
+from train import WIDTH, HEIGHT, CAR_SIZE_X, CAR_SIZE_Y, BORDER_COLOR, MAX_DISTANCE, MAX_STEPS, config_path, \
+    run_simulation
+
+
+# Options of train.py that islands pass on to every island
+DEFAULT_SETTINGS = {"geometry": "raster", "cache_size": 10000, "screen_until": 0, "screen_scale": 0.5,
+                    "screen_keep": 0.2, "snapshot_every": 0, "snapshot_dir": None}
+
+
+def make_sessions(maps, geometry="raster", scale=1):
+    return [SimulationSession(f"maps/map{map_number}.png", WIDTH, HEIGHT, BORDER_COLOR, START_POSITIONS[map_number],
+                              MAX_STEPS, MAX_DISTANCE, (CAR_SIZE_X, CAR_SIZE_Y), geometry=geometry, scale=scale)
+            for map_number in maps]
+
+
+def renumber(genome, population, config):
+    # Give a genome from another island a genome id and hidden node ids from this island's
+    # counters, so they can't clash with the ones this island hands out later
+    genome_config = config.genome_config
+    if genome_config.node_indexer is None:
+        # Nothing on this island added a node yet, start after every node it has
+        genome_config.node_indexer = count(max(max(g.nodes) for g in population.population.values()) + 1)
+
+    mapping = {key: key for key in genome_config.output_keys}
+    for key in sorted(genome.nodes):
+        if key not in mapping:
+            mapping[key] = next(genome_config.node_indexer)
+
+    nodes = {}
+    for key, node in genome.nodes.items():
+        node.key = mapping[key]
+        nodes[node.key] = node
+    connections = {}
+    for (source, target), conn in genome.connections.items():
+        conn.key = (mapping.get(source, source), mapping.get(target, target))
+        connections[conn.key] = conn
+    genome.nodes, genome.connections = nodes, connections
+
+    genome.key = next(population.reproduction.genome_indexer)
+    population.reproduction.ancestors[genome.key] = tuple()
+    return genome
+
+
+def adopt(population, config, migrants):
+    # Migrants take the place of random new offspring, the elites carried over stay
+    offspring = [key for key, genome in population.population.items() if genome.fitness is None]
+    for key, genome in zip(random.sample(offspring, min(len(migrants), len(offspring))), migrants):
+        del population.population[key]
+        genome = renumber(genome, population, config)
+        population.population[genome.key] = genome
+    population.species.speciate(config, population.population, population.generation)
+
+
+def run_island(index, config, maps, combine, epochs, interval, migrants, seed, start_genome, inbox, outbox,
+               reports, settings):
+    # One island: evolves its own population on its own maps, and after every interval
+    # generations sends its best genomes to the next island and takes in those of the previous one
+    random.seed(seed)
+    population = neat.Population(config)
+    if start_genome is not None:
+        population.population[0] = start_genome
+
+    snapshotter = None
+    if settings["snapshot_every"] > 0:
+        snapshotter = Snapshotter(population, os.path.join(settings["snapshot_dir"], f"island-{index}"),
+                                  settings["snapshot_every"])
+        population.add_reporter(snapshotter)
+
+    sessions = make_sessions(maps, settings["geometry"])
+    screening = None
+    if settings["screen_until"] > 0:
+        screening = make_sessions(maps, settings["geometry"], settings["screen_scale"])
+    cache = None
+    if settings["cache_size"] > 0:
+        cache = FitnessCache(tuple(session.context for session in sessions), settings["cache_size"])
+    last_generation = []
+
+    def evaluate(genomes, config):
+        run_simulation(genomes, config, sessions, headless=True, cache=cache, combine=combine, screening=screening,
+                       screen_until=settings["screen_until"], screen_keep=settings["screen_keep"])
+        last_generation[:] = [g for _, g in genomes]
+
+    for epoch in range(epochs):
+        population.run(evaluate, interval)
+
+        fitness = [g.fitness for g in last_generation]
+        best = sorted(last_generation, key=lambda g: g.fitness, reverse=True)
+        reports.put({"island": index, "epoch": epoch, "generation": population.generation,
+                     "best_fitness": max(fitness), "mean_fitness": float(np.mean(fitness)),
+                     "species": len(population.species.species), "best_genome": population.best_genome})
+
+        if epoch < epochs - 1 and outbox is not inbox:
+            outbox.put(best[:migrants])
+            migrated = inbox.get()
+            if snapshotter is not None:
+                # The snapshot of the last generation may still be pickling the population and species
+                snapshotter.wait()
+            adopt(population, config, migrated)
+
+    if snapshotter is not None:
+        snapshotter.close()
+    for session in sessions + (screening or []):
+        session.close()
+
+
+def next_report(reports, processes):
+    # Wait for the next report, but don't wait forever on an island that crashed
+    while True:
+        try:
+            return reports.get(timeout=1)
+        except queue.Empty:
+            if any(process.exitcode not in (None, 0) for process in processes):
+                raise RuntimeError("An island process failed")
+
+
+def run_islands(config, island_maps, combine, generations, interval, migrants, seed=0, start_genome=None,
+                settings=None):
+    # Runs one process per entry of island_maps (the maps that island trains on), passing
+    # migrants around a ring every interval generations. Prints the statistics of all islands
+    # after every interval and returns the best genome of all of them, judged on every map used.
+    # settings overrides entries of DEFAULT_SETTINGS, snapshots go in an island-N directory per island
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    count = len(island_maps)
+    inboxes = [multiprocessing.Queue() for _ in range(count)]
+    reports = multiprocessing.Queue()
+    epochs = max(1, generations // interval)
+
+    processes = []
+    for index, maps in enumerate(island_maps):
+        process = multiprocessing.Process(
+            target=run_island,
+            args=(index, config, maps, combine, epochs, interval, migrants, seed + index,
+                  start_genome if index == 0 else None, inboxes[index], inboxes[(index + 1) % count], reports,
+                  settings))
+        process.start()
+        processes.append(process)
+
+    bests = {}
+    pending = defaultdict(list)
+    try:
+        for epoch in range(epochs):
+            # Islands only wait for their neighbour, so some may already be an epoch or more ahead
+            while len(pending[epoch]) < count:
+                record = next_report(reports, processes)
+                pending[record["epoch"]].append(record)
+            records = sorted(pending.pop(epoch), key=lambda record: record["island"])
+            for record in records:
+                bests[record["island"]] = record["best_genome"]
+
+            print(f"Generation {records[0]['generation']}: "
+                  f"best {max(record['best_fitness'] for record in records):.0f}, "
+                  f"mean {np.mean([record['mean_fitness'] for record in records]):.0f}, "
+                  f"species {sum(record['species'] for record in records)}")
+            for record in records:
+                print(f"    island {record['island']} (maps {island_maps[record['island']]}): "
+                      f"best {record['best_fitness']:.0f}, mean {record['mean_fitness']:.0f}, "
+                      f"species {record['species']}")
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+
+    # The islands may train on different maps, so score their champions on all of them
+    all_maps = sorted(set(map_number for maps in island_maps for map_number in maps))
+    sessions = make_sessions(all_maps, settings["geometry"])
+    candidates = [bests[index] for index in sorted(bests)]
+    results = [session.simulate(candidates, config, 0, show=False) for session in sessions]
+    fitness = combined_fitness(np.stack([r for r, _ in results], axis=1), np.stack([s for _, s in results], axis=1),
+                               MAX_STEPS, combine)
+    for session in sessions:
+        session.close()
+
+    return candidates[int(np.argmax(fitness))]
+
+
+if __name__ == "__main__":
+    # Migrate a genome between two islands whose node counters overlap, the way islands run in
+    # separate processes with a config each. The receiving island is two nodes along, the migrant
+    # has the sending island's fourth and fifth node, so handing out ids from the receiving
+    # counter runs into ids the migrant used itself
+    random.seed(0)
+    islands = []
+    for nodes_added in ((2,), (3, 2)):
+        config = neat.config.Config(neat.DefaultGenome, neat.DefaultReproduction, neat.DefaultSpeciesSet,
+                                    neat.DefaultStagnation, config_path)
+        population = neat.Population(config)
+        for genome, added in zip(population.population.values(), nodes_added):
+            for _ in range(added):
+                genome.mutate_add_node(config.genome_config)
+        islands.append((config, population))
+
+    (config, population), (_, sender) = islands
+    native = {key for genome in population.population.values() for key in genome.nodes}
+    migrant = list(sender.population.values())[1]
+    old_hidden = set(migrant.nodes) - set(config.genome_config.output_keys)
+    adopt(population, config, [migrant])
+
+    hidden = set(migrant.nodes) - set(config.genome_config.output_keys)
+    assert len(hidden) == len(old_hidden) == 2
+    assert not hidden & native, f"The migrant reuses node ids {sorted(hidden & native)}"
+    assert all(key in migrant.nodes or key in config.genome_config.input_keys
+               for connection in migrant.connections for key in connection)
+    print(f"Migrant hidden nodes {sorted(old_hidden)} became {sorted(hidden)}")
@@ -0,0 +1,75 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+
+def genome_key(genome, context=()):
+    # Hash of everything that decides how a genome drives: its nodes and enabled connections,
+    # plus the context (map and simulation settings) it was simulated in. Connections are
+    # kept in their own order, since that is the order the network sums them in
+    nodes = sorted((key, node.bias, node.response, node.activation, node.aggregation)
+                   for key, node in genome.nodes.items())
+    connections = [(key, conn.weight) for key, conn in genome.connections.items() if conn.enabled]
+    return hashlib.sha256(repr((nodes, connections, context)).encode()).hexdigest()
+
+
+class FitnessCache:
+    # Remembers the reward and survived steps of the most recently simulated genomes,
+    # so elites and duplicate children don't have to be simulated again. Those are a
+    # pure function of the genome and the context, unlike the final fitness, which
+    # also depends on how long the rest of the generation survived
+
+    def __init__(self, context, maxsize=10000):
+        self.context = context
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, reward, steps):
+        self.entries[key] = (reward, steps)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def evaluate(self, genomes, simulate, refresh=False):
+        # Rewards and steps for every genome, calling simulate(genomes) -> (rewards, steps)
+        # only for the ones not cached yet, each distinct genome once. Every row of the
+        # results (a number, or one per map) is cached as is.
+        # With refresh every genome is simulated and the cache updated
+        keys = [genome_key(genome, self.context) for genome in genomes]
+        results = [None] * len(genomes)
+
+        missing = {}
+        for i, key in enumerate(keys):
+            entry = None if refresh else self.get(key)
+            if entry is not None:
+                results[i] = entry
+            elif key not in missing:
+                missing[key] = i
+
+        self.hits += len(genomes) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            rows = list(missing.values()) if not refresh else list(range(len(genomes)))
+            new_rewards, new_steps = simulate([genomes[i] for i in rows])
+            for i, reward, step_count in zip(rows, new_rewards, new_steps):
+                results[i] = (np.copy(reward), np.copy(step_count))
+                self.put(keys[i], *results[i])
+
+        # Duplicates of a genome simulated just now
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                results[i] = results[missing[key]]
+
+        rewards = np.array([reward for reward, _ in results], dtype=np.float64)
+        steps = np.array([step_count for _, step_count in results], dtype=np.int64)
+        return rewards, steps
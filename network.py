@@ -0,0 +1,154 @@
+import math
+import numpy as np
+
+# Bump whenever the arrays written by BatchNetwork.save change
+FORMAT_VERSION = 1
+
+# NumPy's vectorized tanh can differ from math.tanh in the last bit, which is enough
+# to flip the choice between two saturated outputs, so use the exact same function as neat
+_tanh = np.frompyfunc(math.tanh, 1, 1)
+
+
+class BatchNetwork:
+    # A whole generation of feed forward networks packed into padded NumPy arrays.
+    # Node slots are laid out as [inputs, outputs, hidden nodes]. Every node is computed
+    # in the same layer and sums its links in the same order as neat.nn.FeedForwardNetwork,
+    # so the outputs are bit for bit the same
+
+    def __init__(self, num_inputs, num_outputs, sources, weights, biases, responses, layers):
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+
+        self.sources = sources  # (networks, slots, links), slot each link of a node reads from
+        self.weights = weights  # (networks, slots, links), 0 for padding
+        self.biases = biases  # (networks, slots)
+        self.responses = responses  # (networks, slots)
+        self.layers = layers  # (networks, slots), layer each node is computed in or -1
+
+        self.num_layers = int(layers.max(initial=-1)) + 1
+
+    def activate(self, inputs, rows=None):
+        # rows optionally picks which networks to run, one input row each
+        sources, weights, biases, responses, layers = self.sources, self.weights, self.biases, self.responses, self.layers
+        if rows is not None:
+            sources, weights, biases, responses, layers = \
+                sources[rows], weights[rows], biases[rows], responses[rows], layers[rows]
+
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if inputs.shape != (len(biases), self.num_inputs):
+            raise RuntimeError(f"Expected inputs of shape {(len(biases), self.num_inputs)}, got {inputs.shape}")
+
+        values = np.zeros(biases.shape)
+        values[:, :self.num_inputs] = inputs
+        index = np.arange(len(values))[:, None]
+
+        for layer in range(self.num_layers):
+            total = np.zeros(values.shape)
+            for link in range(sources.shape[2]):
+                total += values[index, sources[:, :, link]] * weights[:, :, link]
+
+            # Same as neat's tanh activation, which clamps 2.5 * z to [-60, 60]
+            nodes = layers == layer
+            z = np.clip(2.5 * (biases[nodes] + responses[nodes] * total[nodes]), -60.0, 60.0)
+            values[nodes] = _tanh(z).astype(np.float64)
+
+        return values[:, self.num_inputs:self.num_inputs + self.num_outputs]
+
+    def choose(self, inputs, rows=None):
+        # Index of the strongest output of every network, first one on ties like list.index(max(...))
+        return np.argmax(self.activate(inputs, rows), axis=1)
+
+    def save(self, path):
+        # Plain arrays in an .npz file, which np.load reads without unpickling anything
+        np.savez_compressed(path, version=FORMAT_VERSION, activation="tanh", aggregation="sum",
+                            num_inputs=self.num_inputs, num_outputs=self.num_outputs, sources=self.sources,
+                            weights=self.weights, biases=self.biases, responses=self.responses, layers=self.layers)
+
+    @staticmethod
+    def load(path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != FORMAT_VERSION:
+                raise ValueError(f"{path} is a version {int(data['version'])} network, "
+                                 f"only version {FORMAT_VERSION} can be loaded")
+            if str(data["activation"]) != "tanh" or str(data["aggregation"]) != "sum":
+                raise ValueError(f"{path} uses {data['activation']}/{data['aggregation']}, only tanh/sum is supported")
+            return BatchNetwork(int(data["num_inputs"]), int(data["num_outputs"]), data["sources"], data["weights"],
+                                data["biases"], data["responses"], data["layers"])
+
+    @staticmethod
+    def stack(networks):
+        # One batch holding the networks of all the given batches, in order, padded to the largest
+        num_inputs, num_outputs = networks[0].num_inputs, networks[0].num_outputs
+        if any(net.num_inputs != num_inputs or net.num_outputs != num_outputs for net in networks):
+            raise ValueError("Only networks with the same inputs and outputs can be stacked")
+
+        num_slots = max(net.biases.shape[1] for net in networks)
+        num_links = max(net.sources.shape[2] for net in networks)
+
+        def pad(array, value, *shape):
+            padding = [(0, 0)] + [(0, size - current) for size, current in zip(shape, array.shape[1:])]
+            return np.pad(array, padding, constant_values=value)
+
+        return BatchNetwork(num_inputs, num_outputs,
+                            np.concatenate([pad(net.sources, 0, num_slots, num_links) for net in networks]),
+                            np.concatenate([pad(net.weights, 0, num_slots, num_links) for net in networks]),
+                            np.concatenate([pad(net.biases, 0, num_slots) for net in networks]),
+                            np.concatenate([pad(net.responses, 0, num_slots) for net in networks]),
+                            np.concatenate([pad(net.layers, -1, num_slots) for net in networks]))
+
+    @staticmethod
+    def create(genomes, config):
+        # Only building networks from genomes needs neat, running saved ones doesn't
+        from neat.graphs import feed_forward_layers
+
+        genome_config = config.genome_config
+        input_keys = genome_config.input_keys
+        output_keys = genome_config.output_keys
+
+        plans = []
+        for genome in genomes:
+            # Gather expressed connections.
+            connections = [cg.key for cg in genome.connections.values() if cg.enabled]
+            layers = feed_forward_layers(input_keys, output_keys, connections)
+
+            slots = {key: i for i, key in enumerate(input_keys + output_keys)}
+            links = {}
+            for layer in layers:
+                for node in sorted(layer):
+                    if node not in slots:
+                        slots[node] = len(slots)
+                    links[node] = []
+
+                    ng = genome.nodes[node]
+                    if ng.activation != "tanh" or ng.aggregation != "sum":
+                        raise ValueError(f"Node {node} uses {ng.activation}/{ng.aggregation}, "
+                                         "only tanh/sum networks can be batched")
+
+            for inode, onode in connections:
+                if onode in links:
+                    links[onode].append((inode, genome.connections[(inode, onode)].weight))
+
+            plans.append((genome, layers, slots, links))
+
+        num_slots = max((len(slots) for _, _, slots, _ in plans), default=0)
+        num_links = max((len(node_links) for _, _, _, links in plans for node_links in links.values()), default=0)
+        sources = np.zeros((len(plans), num_slots, num_links), dtype=np.int64)
+        weights = np.zeros((len(plans), num_slots, num_links))
+        biases = np.zeros((len(plans), num_slots))
+        responses = np.zeros((len(plans), num_slots))
+        node_layers = np.full((len(plans), num_slots), -1)
+
+        for n, (genome, layers, slots, links) in enumerate(plans):
+            for depth, layer in enumerate(layers):
+                for node in layer:
+                    slot = slots[node]
+                    ng = genome.nodes[node]
+                    biases[n, slot] = ng.bias
+                    responses[n, slot] = ng.response
+                    node_layers[n, slot] = depth
+
+                    for link, (inode, weight) in enumerate(links[node]):
+                        sources[n, slot, link] = slots[inode]
+                        weights[n, slot, link] = weight
+
+        return BatchNetwork(len(input_keys), len(output_keys), sources, weights, biases, responses, node_layers)
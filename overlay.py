@@ -0,0 +1,61 @@
+import pygame
+from time import perf_counter
+
+
+class StatsOverlay:
+    # Generation, cars alive, best fitness and steps/sec drawn in the top left corner of the
+    # window. Every line is rendered once and only rendered again when its text changes
+
+    def __init__(self, font_size=40, color=(255, 255, 255), background=(0, 0, 0), position=(10, 10),
+                 rate_interval=0.5):
+        self.font_size = font_size
+        self.color = color
+        self.background = background
+        self.position = position
+        self.font = None  # Needs pygame.font to be initialised, so made on first draw
+
+        # Label -> (text, rendered surface) of what is currently shown
+        self.lines = {}
+
+        # Steps/sec is measured over rate_interval seconds, so the number stays readable
+        self.rate_interval = rate_interval
+        self.rate = 0.0
+        self.rate_step = 0
+        self.rate_time = perf_counter()
+
+    def steps_per_sec(self, step):
+        now = perf_counter()
+        if step < self.rate_step:
+            # A new generation started
+            self.rate_step, self.rate_time = step, now
+        elif now - self.rate_time >= self.rate_interval:
+            self.rate = (step - self.rate_step) / (now - self.rate_time)
+            self.rate_step, self.rate_time = step, now
+        return self.rate
+
+    def render_line(self, label, text):
+        cached = self.lines.get(label)
+        if cached is None or cached[0] != text:
+            cached = (text, self.font.render(text, True, self.color, self.background))
+            self.lines[label] = cached
+        return cached[1]
+
+    def draw(self, screen, generation, still_alive, best_fitness, step):
+        # Returns the rectangles drawn on
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, self.font_size)
+
+        stats = {
+            "generation": f"Generation: {generation}",
+            "alive": f"Still Alive: {still_alive}",
+            "fitness": f"Best Fitness: {best_fitness:,.0f}",
+            "rate": f"Steps/sec: {self.steps_per_sec(step):,.0f}",
+        }
+
+        x, y = self.position
+        rects = []
+        for label, text in stats.items():
+            rects.append(screen.blit(self.render_line(label, text), (x, y)))
+            y += rects[-1].height
+        return rects
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+from env import CarEnv
+from simulation import simulate, combined_fitness
+from telemetry import StepRecorder
+from track import Track
+from vector_track import VectorTrack
+
+# Per worker state, set up once by _init_worker
+_worker = {}
+
+
+def _open_track(track_dir):
+    # Vector tracks are saved as wall segments, raster tracks as a wall mask
+    if os.path.exists(os.path.join(track_dir, "segments.npy")):
+        return VectorTrack.open(track_dir)
+    return Track.open(track_dir)
+
+
+def _init_worker(track_dirs, config, settings):
+    _worker["tracks"] = [_open_track(track_dir) for track_dir in track_dirs]
+    _worker["config"] = config
+    _worker["settings"] = settings
+
+
+def _evaluate_chunk(task):
+    map_index, genomes = task
+    track, settings = _worker["tracks"][map_index], _worker["settings"]
+    recorder = StepRecorder()
+    env = CarEnv(track, len(genomes), settings["start_positions"][map_index], settings["max_distance"],
+                 settings["car_size"], settings["max_steps"], recorder)
+    rewards, steps = simulate(genomes, _worker["config"], env)
+    return rewards, steps, recorder.alive
+
+
+class ParallelEvaluator:
+    # Splits every generation into one chunk per worker for each map, and simulates all
+    # the chunks side by side. The workers memory map the map arrays from the tracks' cache
+    # directories (or temporary copies), so they share a single copy instead of each
+    # loading and scaling the PNGs. maps is a list of (track, start_pos) pairs
+
+    def __init__(self, workers, maps, config, max_steps, max_distance, car_size):
+        self.workers = workers
+        self.max_steps = max_steps
+        self.map_count = len(maps)
+
+        self.temporary_dirs = []
+        track_dirs = []
+        for track, _ in maps:
+            track_dir = track.directory
+            if track_dir is None:
+                track_dir = tempfile.mkdtemp(prefix="ai_cars_track_")
+                track.save(track_dir)
+                self.temporary_dirs.append(track_dir)
+            track_dirs.append(track_dir)
+
+        settings = {"start_positions": [start_pos for _, start_pos in maps], "max_steps": max_steps,
+                    "max_distance": max_distance, "car_size": car_size}
+        self.pool = multiprocessing.Pool(workers, _init_worker, (track_dirs, config, settings))
+
+        # Cars alive on every step of the last simulate, per map and summed over the chunks
+        self.alive = [[] for _ in maps]
+
+    def simulate(self, genomes):
+        # Rewards and steps of every genome on every map, shape (genomes, maps), identical
+        # to simulating them all in one process
+        chunks = [chunk for chunk in np.array_split(np.arange(len(genomes)), self.workers) if chunk.size]
+        tasks = [(map_index, [genomes[i] for i in chunk]) for map_index in range(self.map_count) for chunk in chunks]
+        results = iter(self.pool.map(_evaluate_chunk, tasks))
+
+        rewards = np.zeros((len(genomes), self.map_count))
+        steps = np.zeros((len(genomes), self.map_count), dtype=np.int64)
+        for map_index in range(self.map_count):
+            alive = np.zeros(0, dtype=np.int64)
+            for chunk in chunks:
+                rewards[chunk, map_index], steps[chunk, map_index], chunk_alive = next(results)
+                alive = np.pad(alive, (0, max(0, len(chunk_alive) - len(alive))))
+                alive[:len(chunk_alive)] += chunk_alive
+            self.alive[map_index] = alive.tolist()
+        return rewards, steps
+
+    def evaluate(self, genomes, how="mean"):
+        # Fitness for every (genome_id, genome) pair
+        return combined_fitness(*self.simulate([g for _, g in genomes]), self.max_steps, how)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        for temporary_dir in self.temporary_dirs:
+            shutil.rmtree(temporary_dir, ignore_errors=True)
@@ -0,0 +1,48 @@
+import numpy as np
+import pygame
+
+
+class RenderPolicy:
+    # Decides how much of the simulation gets drawn. The simulation runs the same either
+    # way, steps that are not drawn just don't wait for the frame cap:
+    #   every       draw one out of every N simulation steps
+    #   top_k       only draw the K cars with the highest fitness so far
+    #   dirty_rects only redraw and update the parts of the screen the cars touched
+
+    def __init__(self, every=1, top_k=None, dirty_rects=False, fps=60):
+        self.every = max(1, every)
+        self.top_k = top_k
+        self.dirty_rects = dirty_rects
+        self.fps = fps
+
+        # Rectangles drawn on the last frame, None means the whole screen needs redrawing
+        self.previous = None
+
+    def due(self, step):
+        return step % self.every == 0
+
+    def select(self, alive, scores):
+        # Indices of the living cars worth drawing
+        rows = np.flatnonzero(alive)
+        if self.top_k is not None and rows.size > self.top_k:
+            rows = rows[np.argpartition(-scores[rows], self.top_k - 1)[:self.top_k]]
+        return rows
+
+    def invalidate(self):
+        self.previous = None
+
+    def clear(self, screen, background):
+        # Erase what was drawn on the last frame
+        if not self.dirty_rects or self.previous is None:
+            screen.blit(background, (0, 0))
+        else:
+            for rect in self.previous:
+                screen.blit(background, rect, rect)
+
+    def show(self, rects):
+        # Put the frame on the display, rects are everything drawn since clear
+        if not self.dirty_rects or self.previous is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.previous + rects)
+        self.previous = rects
@@ -0,0 +1,112 @@
+import pygame
+import sys
+from functools import partial
+from env import CarEnv
+from overlay import StatsOverlay
+from render import RenderPolicy
+from simulation import simulate, final_fitness
+from telemetry import NULL_PROFILER
+from track import Track
+from vector_track import VectorTrack
+
+# How the walls of a map are represented: as a wall mask, or as line segments
+GEOMETRIES = {"raster": Track, "vector": VectorTrack}
+
+
+class SimulationSession:
+    # Everything that stays the same from one generation to the next: the window,
+    # the scaled map with its derived arrays and the car fleet. Create it once and
+    # reuse it for every generation of population.run, then close it
+
+    def __init__(self, map_path, width, height, border_color, start_pos, max_steps, max_distance, car_size,
+                 caption="AI Cars", show_stats=False, profiler=NULL_PROFILER, render_policy=None, geometry="raster",
+                 scale=1):
+        self.map_path = map_path
+        self.geometry = geometry
+
+        # With a scale below 1 the map is loaded at that fraction of width and height, and the
+        # cars are scaled down with it: a cheaper, rougher simulation of the same track
+        self.scale = scale
+        self.track = GEOMETRIES[geometry].load(map_path, round(width * scale), round(height * scale), border_color)
+
+        self.start_pos = start_pos
+        self.max_steps = max_steps
+        self.max_distance = max_distance
+        self.car_size = car_size
+
+        self.caption = caption
+        self.overlay = StatsOverlay() if show_stats else None
+        self.profiler = profiler.simulation(map_path if scale == 1 else f"{map_path} x{scale}")
+        self.render_policy = render_policy if render_policy is not None else RenderPolicy()
+
+        self.screen = None
+        self.clock = None
+        self.env = None
+
+    def open_window(self):
+        if self.screen is not None:
+            return
+
+        pygame.init()
+        self.screen = pygame.display.set_mode((self.track.width, self.track.height))
+        pygame.display.set_caption(self.caption)
+        self.clock = pygame.time.Clock()
+        self.track.surface = self.track.surface.convert()  # Faster blitting
+
+    def make_env(self, count):
+        # Only build a new environment when the population size changed
+        if self.env is None or self.env.count != count:
+            self.env = CarEnv(self.track, count, self.start_pos, self.max_distance, self.car_size, self.max_steps,
+                              self.profiler, self.scale)
+        return self.env
+
+    @property
+    def context(self):
+        # Everything besides the genome that decides how a car does
+        return (self.map_path, self.track.width, self.track.height, tuple(self.start_pos), self.max_steps,
+                self.max_distance, tuple(self.car_size), self.geometry, self.scale)
+
+    def run_generation(self, genomes, config, generation, show=True):
+        rewards, steps = self.simulate(genomes, config, generation, show)
+        return final_fitness(rewards, steps, self.max_steps)
+
+    def simulate(self, genomes, config, generation, show=True):
+        # Rewards and steps of every genome, see simulation.simulate
+        env = self.make_env(len(genomes))
+
+        on_step = None
+        if show:
+            self.open_window()
+            on_step = partial(self.render, generation)
+            self.render_policy.invalidate()
+
+        return simulate(genomes, config, env, on_step)
+
+    def render(self, generation, fleet, still_alive, step, rewards):
+        policy = self.render_policy
+        if not policy.due(step):
+            return
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                sys.exit()
+
+        # Render
+        with self.profiler.phase("render"):
+            policy.clear(self.screen, self.track.surface)
+            rects = fleet.draw(self.screen, policy.select(fleet.alive, rewards))
+
+        # Stats
+        if self.overlay is not None:
+            with self.profiler.phase("overlay"):
+                rects += self.overlay.draw(self.screen, generation, still_alive, rewards.max(), step)
+
+        with self.profiler.phase("flip"):
+            policy.show(rects)
+        with self.profiler.phase("clock_tick"):
+            self.clock.tick(policy.fps)
+
+    def close(self):
+        if self.screen is not None:
+            pygame.quit()
+            self.screen = None
@@ -0,0 +1,51 @@
+import numpy as np
+from network import BatchNetwork
+
+
+def simulate(genomes, config, env, on_step=None):
+    # Drive one car of the environment per genome until they are all done (crashed or out
+    # of steps). Returns the reward every car collected and the number of steps it
+    # survived, turn those into fitness with final_fitness
+    nets = BatchNetwork.create(genomes, config)
+    rewards = np.zeros(len(genomes))
+    profiler = env.profiler
+
+    obs = env.reset()
+    dones = env.dones
+    while not dones.all():
+        alive = ~dones
+        still_alive = int(alive.sum())
+        profiler.step(still_alive)
+
+        # For each living car get the acton it takes
+        with profiler.phase("network"):
+            actions = np.full(len(genomes), -1)
+            actions[alive] = nets.choose(obs[alive], alive)
+
+        # Move the living cars and increase their reward
+        obs, step_rewards, dones = env.step(actions)
+        rewards += step_rewards
+
+        if on_step is not None:
+            on_step(env.fleet, still_alive, env.steps - 1, rewards)
+
+    return rewards, env.fleet.time.copy()
+
+
+def final_fitness(rewards, steps, max_steps):
+    # A generation runs one more step after its last crash (or until max_steps),
+    # and every crashed car loses half its fitness on each step it spends dead.
+    # Computed from the results of all cars together, so splitting a generation
+    # into chunks gives exactly the same fitness as simulating it in one go
+    generation_steps = min(max_steps, int(steps.max(initial=0)) + 1)
+    return np.ldexp(rewards, -(generation_steps - steps))  # Death negative
+
+
+def combined_fitness(rewards, steps, max_steps, how="mean"):
+    # Rewards and steps of shape (genomes, maps): the fitness on every map, combined
+    # into one by the mean or by the worst map (min)
+    fitness = np.stack([final_fitness(rewards[:, i], steps[:, i], max_steps) for i in range(rewards.shape[1])],
+                       axis=1)
+    if how == "min":
+        return fitness.min(axis=1)
+    return fitness.mean(axis=1)
@@ -0,0 +1,211 @@
+import io
+import lzma
+import os
+import pickle
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+import neat
+from neat.reporting import BaseReporter
+
+# Every this many snapshots one is written in full, the ones in between only store
+# the genomes that are new since the previous one
+FULL_EVERY = 10
+
+SNAPSHOT_NAME = "gen_{:05d}.snapshot"
+
+
+def new_run_id():
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + os.urandom(3).hex()
+
+
+def _peek(counter):
+    # Next value of an itertools.count, which can't be read without using it up
+    if counter is None:
+        return None, None
+    value = next(counter)
+    return value, count(value)
+
+
+class _StatePickler(pickle.Pickler):
+    # Stores genomes as numbered references into a table of genomes, adding the ones it
+    # hasn't seen before. Genomes never change once created, apart from their fitness,
+    # so that is stored with the references instead
+    def __init__(self, file, writer, fitness):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.writer = writer
+        self.fitness = fitness
+        self.new_genomes = {}
+        self.references = {}
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, self.writer.genome_type):
+            return None
+        known = self.writer.table.get(id(obj))
+        if known is None:
+            known = self.writer.table[id(obj)] = (next(self.writer.serials), obj)
+            self.new_genomes[known[0]] = obj
+        self.references[known[0]] = self.fitness.get(id(obj), obj.fitness)
+        return known[0]
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, table, fitness):
+        super().__init__(file)
+        self.table = table
+        self.fitness = fitness
+
+    def persistent_load(self, pid):
+        genome = self.table[pid]
+        genome.fitness = self.fitness[pid]
+        return genome
+
+
+def _read(path):
+    with lzma.open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _genome_table(path, run=None):
+    # Genomes of a snapshot and of all the snapshots it builds on, which all have to come from the same run
+    payload = _read(path)
+    if run is not None and payload.get("run") != run:
+        raise ValueError(f"{path} was written by run {payload.get('run')}, not by run {run} that builds on it")
+    table = {}
+    if payload["base"] is not None:
+        table, _ = _genome_table(os.path.join(os.path.dirname(path), payload["base"]), payload.get("run"))
+    table.update(payload["genomes"])
+    return table, payload
+
+
+def load_snapshot(path):
+    table, payload = _genome_table(path)
+    return _StateUnpickler(io.BytesIO(payload["state"]), table, payload["fitness"]).load()
+
+
+def latest_snapshot(directory):
+    # Most recently written snapshot in directory, or in any of the run directories in it
+    folders = [directory] + [os.path.join(directory, name) for name in os.listdir(directory)
+                             if os.path.isdir(os.path.join(directory, name))]
+    snapshots = []
+    for folder in folders:
+        for name in os.listdir(folder):
+            match = re.fullmatch(r"gen_(\d+)\.snapshot", name)
+            if match:
+                path = os.path.join(folder, name)
+                snapshots.append((os.path.getmtime(path), int(match.group(1)), path))
+    if not snapshots:
+        raise FileNotFoundError(f"No snapshots in {directory}")
+    return max(snapshots)[2]
+
+
+def restore_population(path, config):
+    # A population that carries on exactly where the snapshot was taken: same genomes,
+    # species, stagnation, id counters and random state
+    state = load_snapshot(path)
+
+    population = neat.Population(config, (state["population"], None, state["generation"]))
+    population.species = config.species_set_type(config.species_set_config, population.reporters)
+    population.species.species = state["species"]
+    population.species.genome_to_species = state["genome_to_species"]
+    population.species.indexer = count(state["species_index"])
+
+    population.reproduction.genome_indexer = count(state["genome_index"])
+    population.reproduction.ancestors = state["ancestors"]
+    config.genome_config.node_indexer = None if state["node_index"] is None else count(state["node_index"])
+
+    population.best_genome = state["best_genome"]
+    random.setstate(state["random"])
+    return population
+
+
+class Snapshotter(BaseReporter):
+    # Neat reporter that saves the complete state of a population every `every` generations,
+    # in a directory of its own inside directory (one per run, so runs never mix snapshots).
+    # The state is gathered at the end of the generation, then pickled, compressed and
+    # written on a background thread while the next generation is being evaluated. Nothing
+    # it refers to changes before the next reproduction besides fitness values, which are
+    # copied up front, so that is the only point we wait for it. Anything else that changes the
+    # population between generations has to call wait first
+
+    def __init__(self, population, directory, every=50, full_every=FULL_EVERY):
+        self.population = population
+        self.run = new_run_id()
+        self.directory = os.path.join(directory, f"run-{self.run}")
+        self.every = every
+        self.full_every = full_every
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+        # Genomes stored since the last full snapshot, id(genome) -> (serial, genome)
+        self.table = {}
+        self.serials = count()
+        self.base = None
+        self.written = 0
+        self.genome_type = None
+
+        os.makedirs(self.directory)
+
+    def end_generation(self, config, population, species_set):
+        generation = self.population.generation + 1  # Incremented right after this
+        if generation % self.every:
+            return
+        self.wait()
+
+        reproduction = self.population.reproduction
+        genome_index, reproduction.genome_indexer = _peek(reproduction.genome_indexer)
+        node_index, config.genome_config.node_indexer = _peek(config.genome_config.node_indexer)
+        species_index, species_set.indexer = _peek(species_set.indexer)
+
+        genomes = list(population.values()) + [self.population.best_genome]
+        fitness = {id(genome): genome.fitness for genome in genomes if genome is not None}
+
+        state = {
+            "generation": generation,
+            "population": population,
+            "species": dict(species_set.species),
+            "genome_to_species": dict(species_set.genome_to_species),
+            "species_index": species_index,
+            "genome_index": genome_index,
+            "node_index": node_index,
+            "ancestors": dict(reproduction.ancestors),
+            "best_genome": self.population.best_genome,
+            "random": random.getstate(),
+        }
+        self.genome_type = config.genome_type
+        self.pending = self.executor.submit(self.write, state, fitness)
+
+    def post_evaluate(self, config, population, species, best_genome):
+        # Reproduction is about to change the species the last snapshot refers to
+        self.wait()
+
+    def write(self, state, fitness):
+        if self.written % self.full_every == 0:
+            self.table, self.serials, self.base = {}, count(), None
+
+        buffer = io.BytesIO()
+        pickler = _StatePickler(buffer, self, fitness)
+        pickler.dump(state)
+        payload = {"run": self.run, "base": self.base, "genomes": pickler.new_genomes, "fitness": pickler.references,
+                   "state": buffer.getvalue()}
+
+        name = SNAPSHOT_NAME.format(state["generation"])
+        path = os.path.join(self.directory, name)
+        with lzma.open(path + ".tmp", "wb") as f:
+            pickle.dump(payload, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+        self.base = name
+        self.written += 1
+
+    def wait(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
@@ -0,0 +1,36 @@
+import pygame
+from functools import lru_cache
+
+# Cars only ever turn in steps of this many degrees
+ANGLE_STEP = 10
+
+
+def rotate_center(image, angle):
+    rectangle = image.get_rect()
+    rotated_image = pygame.transform.rotate(image, angle)
+    rotated_rectangle = rectangle.copy()
+    rotated_rectangle.center = rotated_image.get_rect().center
+    rotated_image = rotated_image.subsurface(rotated_rectangle).copy()
+    return rotated_image
+
+
+class SpriteAtlas:
+    # An image loaded once and pre-rotated for every angle a car can face
+
+    def __init__(self, path, size, step=ANGLE_STEP):
+        image = pygame.image.load(path)
+        if pygame.display.get_surface() is not None:
+            image = image.convert()  # Only possible once a window exists
+        image = pygame.transform.scale(image, size)
+
+        self.step = step
+        self.frames = [rotate_center(image, angle) for angle in range(0, 360, step)]
+
+    def get(self, angle):
+        return self.frames[round(angle / self.step) % len(self.frames)]
+
+
+@lru_cache(maxsize=None)
+def car_atlas(size_x, size_y, path='car.png'):
+    # Shared by every car in the process, built the first time a car gets drawn
+    return SpriteAtlas(path, (size_x, size_y))
@@ -0,0 +1,119 @@
+import json
+from collections import defaultdict
+from contextlib import nullcontext
+from time import perf_counter
+
+try:
+    from neat.reporting import BaseReporter
+except ImportError:
+    # The simulation itself runs without neat, e.g. custom_test.py with exported networks
+    BaseReporter = object
+
+
+class _Phase:
+    def __init__(self, totals, name):
+        self.totals = totals
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        self.totals[self.name] += perf_counter() - self.start
+
+
+class NullProfiler:
+    # Stands in when profiling is turned off, so the hot loop only pays for an empty with block
+    _nothing = nullcontext()
+
+    def phase(self, name):
+        return self._nothing
+
+    def step(self, still_alive):
+        pass
+
+    def record(self, alive):
+        pass
+
+    def simulation(self, name):
+        return self
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class StepRecorder(NullProfiler):
+    # Only counts the cars alive on every step, for worker processes to send back
+    def __init__(self):
+        self.alive = []
+
+    def step(self, still_alive):
+        self.alive.append(still_alive)
+
+
+class _Simulation:
+    # One simulation (map and scale) of a Profiler: its phases count towards the totals,
+    # its steps are kept apart from those of the other simulations
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def phase(self, name):
+        return self.profiler.phase(name)
+
+    def step(self, still_alive):
+        self.profiler.alive[self.name].append(still_alive)
+
+    def record(self, alive):
+        # Steps simulated somewhere else, like in a worker process
+        self.profiler.alive[self.name].extend(alive)
+
+    def simulation(self, name):
+        return self.profiler.simulation(name)
+
+
+class Profiler(BaseReporter):
+    # Times every phase of the simulation per tick and totals it per generation.
+    # Also a neat reporter: add it to the population and it writes one JSON line per
+    # generation with the phase totals, steps/sec and, for every simulation (each map, and
+    # each scale of it), how many cars were alive each step
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = None
+        self.start_generation(0)
+
+    def phase(self, name):
+        return _Phase(self.totals, name)
+
+    def step(self, still_alive):
+        self.alive["main"].append(still_alive)
+
+    def record(self, alive):
+        self.alive["main"].extend(alive)
+
+    def simulation(self, name):
+        return _Simulation(self, name)
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.totals = defaultdict(float)
+        self.alive = defaultdict(list)
+        self.started = perf_counter()
+
+    def post_evaluate(self, config, population, species, best_genome):
+        elapsed = perf_counter() - self.started
+        steps = sum(len(alive) for alive in self.alive.values())
+        record = {
+            "generation": self.generation,
+            "seconds": elapsed,
+            "steps": steps,
+            "steps_per_sec": steps / elapsed if elapsed else 0.0,
+            "car_steps": sum(sum(alive) for alive in self.alive.values()),
+            "best_fitness": best_genome.fitness,
+            "phases": dict(self.totals),
+            "simulations": {name: {"steps": len(alive), "car_steps": sum(alive), "alive": alive}
+                            for name, alive in self.alive.items()},
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
@@ -0,0 +1,301 @@
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import numpy as np
+import pygame
+from checkpoints import CHECKPOINT_RADIUS, checkpoint_radius, checkpoint_raster, load_checkpoints, sidecar_path
+
+# Distances further than this from a wall are stored as this value
+DISTANCE_CAP = 64
+
+# Compiled maps are kept here, one directory per source image, resolution and border color
+CACHE_DIR = "map_cache"
+
+# Bump whenever what gets stored in the cache changes
+CACHE_VERSION = 2
+
+
+def wall_mask(pixels, border_color):
+    # Boolean array indexed [x, y] like Surface.get_at, True where the map has a wall
+    # Alpha is ignored, just like it is once the map has been converted for display
+    return np.all(pixels == np.array(border_color[:3], dtype=pixels.dtype), axis=2)
+
+
+def cache_path(path, width, height, border_color, cache_dir=CACHE_DIR, kind="raster"):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        digest.update(f.read())
+    if os.path.exists(sidecar_path(path)):
+        with open(sidecar_path(path), "rb") as f:
+            digest.update(f.read())
+    digest.update(repr((width, height, tuple(border_color[:3]), DISTANCE_CAP, CHECKPOINT_RADIUS, CACHE_VERSION,
+                        kind)).encode())
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}-{digest.hexdigest()[:16]}")
+
+
+def load_cached(cls, path, width, height, border_color, cache_dir=CACHE_DIR, kind="raster"):
+    # Compile the map the first time it is used at this size, after that
+    # every run (and every worker process) opens the cached arrays
+    if cache_dir is None:
+        return cls.compile(path, width, height, border_color)
+
+    directory = cache_path(path, width, height, border_color, cache_dir, kind)
+    if not os.path.isdir(directory):
+        os.makedirs(cache_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=cache_dir)
+        cls.compile(path, width, height, border_color).save(staging)
+        try:
+            os.rename(staging, directory)
+        except OSError:
+            # Another process finished compiling the same map first
+            shutil.rmtree(staging, ignore_errors=True)
+
+    return cls.open(directory)
+
+
+def distance_field(walls, cap=DISTANCE_CAP):
+    # Euclidean distance from every pixel to the nearest wall pixel, capped at cap
+    # Everything outside the map counts as wall, so rays can never step off of it
+    width, height = walls.shape
+
+    # Vertical distance to the nearest wall in the same column
+    ys = np.arange(height)
+    above = np.maximum.accumulate(np.where(walls, ys, -1), axis=1)
+    below = np.minimum.accumulate(np.where(walls, ys, height)[:, ::-1], axis=1)[:, ::-1]
+    column = np.minimum(np.minimum(ys - above, below - ys), cap).astype(np.int32)
+    column_sq = column ** 2
+
+    # Combine columns up to cap pixels to the left and right
+    xs = np.arange(width)[:, None]
+    dist_sq = np.minimum(column_sq, np.minimum(xs + 1, width - xs) ** 2)
+    for dx in range(1, min(cap, width)):
+        np.minimum(dist_sq[dx:], column_sq[:-dx] + dx * dx, out=dist_sq[dx:])
+        np.minimum(dist_sq[:-dx], column_sq[dx:] + dx * dx, out=dist_sq[:-dx])
+
+    return np.minimum(np.sqrt(dist_sq, dtype=np.float32), cap)
+
+
+class Track:
+    def __init__(self, walls, distance, surface=None, pixels=None, directory=None, checkpoints=None,
+                 checkpoint_ids=None):
+        self.walls = walls
+        self.distance = distance
+        self.width, self.height = walls.shape
+
+        # Checkpoints in driving order, shape (count, 2), and the id of the checkpoint every
+        # pixel belongs to (-1 for none). Maps without a checkpoint file have neither
+        self.checkpoints = checkpoints
+        self.checkpoint_ids = checkpoint_ids
+
+        # Only needed for drawing, headless runs never build the surface
+        self.pixels = pixels
+        self._surface = surface
+
+        # Cache directory the arrays are memory mapped from, if any
+        self.directory = directory
+
+    @property
+    def surface(self):
+        # Built from the (cached) pixels the first time something gets drawn
+        if self._surface is None and self.pixels is not None:
+            self._surface = pygame.surfarray.make_surface(np.asarray(self.pixels))
+            if pygame.display.get_surface() is not None:
+                self._surface = self._surface.convert()  # Faster blitting once a window exists
+        return self._surface
+
+    @surface.setter
+    def surface(self, surface):
+        self._surface = surface
+
+    @classmethod
+    def from_surface(cls, surface, border_color, checkpoints=()):
+        pixels = pygame.surfarray.array3d(surface)
+        walls = wall_mask(pixels, border_color)
+
+        checkpoint_ids = None
+        if len(checkpoints):
+            checkpoints = np.array(checkpoints, dtype=np.float64)
+            checkpoint_ids = checkpoint_raster(walls, checkpoints, checkpoint_radius(walls.shape[0]))
+        else:
+            checkpoints = None
+
+        return cls(walls, distance_field(walls), surface, pixels, checkpoints=checkpoints,
+                   checkpoint_ids=checkpoint_ids)
+
+    @classmethod
+    def compile(cls, path, width, height, border_color):
+        raw_map = pygame.image.load(path)
+        surface = pygame.transform.scale(raw_map, (width, height))
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()  # Faster blitting once a window exists
+
+        # Checkpoint files are in pixels of the map image, scale them with the map
+        scale_x, scale_y = width / raw_map.get_width(), height / raw_map.get_height()
+        checkpoints = [(x * scale_x, y * scale_y) for x, y in load_checkpoints(path)]
+        return cls.from_surface(surface, border_color, checkpoints)
+
+    @classmethod
+    def load(cls, path, width, height, border_color, cache_dir=CACHE_DIR):
+        # The cached arrays are memory mapped, so every process reading them shares the same pages
+        return load_cached(cls, path, width, height, border_color, cache_dir)
+
+    def save(self, directory):
+        np.save(os.path.join(directory, "walls.npy"), self.walls)
+        np.save(os.path.join(directory, "distance.npy"), self.distance)
+        if self.pixels is not None:
+            np.save(os.path.join(directory, "pixels.npy"), self.pixels)
+        if self.checkpoints is not None:
+            np.save(os.path.join(directory, "checkpoints.npy"), self.checkpoints)
+            np.save(os.path.join(directory, "checkpoint_ids.npy"), self.checkpoint_ids)
+
+    @classmethod
+    def open(cls, directory):
+        # Memory map the arrays written by save, so every process reading them shares the same pages
+        walls = np.load(os.path.join(directory, "walls.npy"), mmap_mode="r")
+        distance = np.load(os.path.join(directory, "distance.npy"), mmap_mode="r")
+        pixels = None
+        if os.path.exists(os.path.join(directory, "pixels.npy")):
+            pixels = np.load(os.path.join(directory, "pixels.npy"), mmap_mode="r")
+        checkpoints = checkpoint_ids = None
+        if os.path.exists(os.path.join(directory, "checkpoints.npy")):
+            checkpoints = np.load(os.path.join(directory, "checkpoints.npy"))
+            checkpoint_ids = np.load(os.path.join(directory, "checkpoint_ids.npy"), mmap_mode="r")
+        return cls(walls, distance, pixels=pixels, directory=directory, checkpoints=checkpoints,
+                   checkpoint_ids=checkpoint_ids)
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def is_wall(self, x, y):
+        # Everything outside the map counts as wall
+        return not self.in_bounds(x, y) or self.walls[x, y]
+
+    def box_hits(self, corner_x, corner_y):
+        # Which corners of the boxes given by their corners, shape (boxes, 4), are on a wall pixel
+        int_x, int_y = corner_x.astype(np.int64), corner_y.astype(np.int64)
+        inside = (int_x > 0) & (int_x < self.width) & (int_y > 0) & (int_y < self.height)
+        hit = np.zeros(corner_x.shape, dtype=bool)
+        hit[inside] = self.walls[int_x[inside], int_y[inside]]
+        return hit
+
+    def checkpoint_at(self, x, y):
+        # Id of the checkpoint every point is at (-1 for none), one lookup in the checkpoint raster each
+        ix = np.clip(x.astype(np.int64), 0, self.width - 1)
+        iy = np.clip(y.astype(np.int64), 0, self.height - 1)
+        return self.checkpoint_ids[ix, iy].astype(np.int64)
+
+    def cast_ray(self, origin, angle_rad, max_distance):
+        # Sphere tracing: jump ahead as far as the distance field says is safe.
+        # A sample can land up to sqrt(2) pixels away from where it was aimed, so we
+        # keep that much margin, and every skipped sample is then known to be open
+        # track. That way we stop at exactly the sample march_ray would have stopped at.
+        cos, sin = math.cos(angle_rad), math.sin(angle_rad)
+        x, y = origin
+        length = 0
+        while length < max_distance:
+            ix, iy = int(x), int(y)
+            if not self.in_bounds(ix, iy):
+                break
+            clearance = self.distance[ix, iy]
+            if clearance == 0:
+                break
+
+            length = min(length + max(1, int(clearance - 1.5)), max_distance)
+            x = origin[0] + cos * length
+            y = origin[1] + sin * length
+
+        return x, y
+
+    def cast_rays(self, origin_x, origin_y, angle_rad, max_distance):
+        # Same as cast_ray, but for a whole batch of rays at once
+        cos, sin = np.cos(angle_rad), np.sin(angle_rad)
+        x, y = origin_x.astype(np.float64), origin_y.astype(np.float64)
+        length = np.zeros(x.shape, dtype=np.int64)
+
+        active = np.flatnonzero(length < max_distance)
+        while active.size:
+            ix, iy = x[active].astype(np.int64), y[active].astype(np.int64)
+            inside = (ix >= 0) & (ix < self.width) & (iy >= 0) & (iy < self.height)
+            clearance = np.zeros(active.shape, dtype=np.float32)
+            clearance[inside] = self.distance[ix[inside], iy[inside]]
+
+            moving = clearance > 0
+            active = active[moving]
+            step = np.maximum(1, (clearance[moving] - 1.5).astype(np.int64))
+            length[active] = np.minimum(length[active] + step, max_distance)
+            x[active] = origin_x[active] + cos[active] * length[active]
+            y[active] = origin_y[active] + sin[active] * length[active]
+
+            active = active[length[active] < max_distance]
+
+        return x, y
+
+    def sweep(self, start_x, start_y, end_x, end_y):
+        # True for every segment from start to end that passes over a wall pixel, the end
+        # point itself is left to the caller. Open track is skipped using the distance
+        # field like cast_ray does, close to walls the segment is followed pixel by pixel
+        # (every pixel it touches, even diagonally), so the number of steps adapts to both
+        # the length of the segment and how close it gets to a wall.
+        # Unlike cast_ray, pixels outside of the map don't count as walls here
+        length = np.hypot(end_x - start_x, end_y - start_y)
+        hit = np.zeros(length.shape, dtype=bool)
+        t = np.zeros(length.shape)
+
+        active = np.flatnonzero(length > 0)
+        dir_x = (end_x[active] - start_x[active]) / length[active]
+        dir_y = (end_y[active] - start_y[active]) / length[active]
+        while active.size:
+            x = start_x[active] + dir_x * t[active]
+            y = start_y[active] + dir_y * t[active]
+            ix, iy = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+            inside = (ix >= 0) & (ix < self.width) & (iy >= 0) & (iy < self.height)
+            clearance = np.ones(active.shape, dtype=np.float32)
+            clearance[inside] = self.distance[ix[inside], iy[inside]]
+            hit[active[clearance == 0]] = True
+
+            # Distance to where the segment leaves the current pixel
+            with np.errstate(divide="ignore", invalid="ignore"):
+                to_x = np.where(dir_x > 0, (ix + 1 - x) / dir_x, np.where(dir_x < 0, (x - ix) / -dir_x, np.inf))
+                to_y = np.where(dir_y > 0, (iy + 1 - y) / dir_y, np.where(dir_y < 0, (y - iy) / -dir_y, np.inf))
+            t[active] += np.maximum(clearance - 1.5, np.minimum(to_x, to_y)) + 1e-6
+
+            keep = (clearance > 0) & (t[active] < length[active])
+            active, dir_x, dir_y = active[keep], dir_x[keep], dir_y[keep]
+
+        return hit
+
+    def march_ray(self, origin, angle_rad, max_distance):
+        # Reference implementation that checks every pixel along the ray
+        x, y = origin
+        for length in range(1, max_distance + 1):
+            if self.is_wall(int(x), int(y)):
+                break
+
+            x = origin[0] + math.cos(angle_rad) * length
+            y = origin[1] + math.sin(angle_rad) * length
+
+        return x, y
+
+
+if __name__ == "__main__":
+    # Check that the sphere traced radar agrees with stepping pixel by pixel
+    rng = np.random.default_rng(0)
+    for map_number in range(1, 7):
+        track = Track.load(f"maps/map{map_number}.png", 1920, 1060, (255, 255, 255, 255))
+        open_pixels = np.argwhere(~track.walls)
+        origins = open_pixels[rng.integers(len(open_pixels), size=2000)] + rng.random((2000, 2))
+        angles = rng.uniform(0, 2 * math.pi, 2000)
+
+        batch_x, batch_y = track.cast_rays(origins[:, 0], origins[:, 1], angles, 300)
+        worst = 0
+        for origin, angle_rad, batch in zip(origins, angles, zip(batch_x, batch_y)):
+            slow = math.dist(origin, track.march_ray(origin, angle_rad, 300))
+            for fast in (track.cast_ray(origin, angle_rad, 300), batch):
+                worst = max(worst, abs(math.dist(origin, fast) - slow))
+
+        print(f"Map {map_number}: largest radar difference {worst:.3f} px")
+        assert worst <= 1, "Sphere traced radar disagrees with per-pixel stepping"
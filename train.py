@@ -1,11 +1,18 @@
+import argparse
 import pickle
 import os
 import neat
-import pygame
-import sys
-from time import time
-from tkinter import Tk, Label
-from car import Car
+import numpy as np
+from functools import partial
+from constants import START_POSITIONS
+from memo import FitnessCache
+from network import BatchNetwork
+from parallel import ParallelEvaluator
+from render import RenderPolicy
+from session import SimulationSession
+from simulation import combined_fitness
+from snapshots import Snapshotter, latest_snapshot, restore_population
+from telemetry import NULL_PROFILER, Profiler
 
 WIDTH = 1920
 HEIGHT = 1060
@@ -17,107 +24,121 @@ BORDER_COLOR = (255, 255, 255, 255)
 
 MAX_DISTANCE = 300
 
-START_POS = [830, 870]
+# Simulation steps per generation (10 seconds at 60 FPS)
+MAX_STEPS = 600
 
 # Init variables
-MAP_NUMBER = 3
+MAP_NUMBER = 3  # Map trained on unless --maps says otherwise
 
-# File to store the best model
+# File to store the best model, and the file its network is exported to for custom_test.py
 MODEL_FILE = "genomes/best_genome.pkl"
+EXPORT_FILE = "genomes/best_genome.npz"
 
-config_path = "./config.txt"
-
-current_generation = 0
-
+# Generations to train for
+GENERATIONS = 1000
 
-def run_simulation(genomes, config):
-    nets = []
-    cars = []
+# Where full population snapshots go, and how often
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_EVERY = 50
 
-    window = Tk()
-    window.title("AI Cars [Info]")
-    window.geometry("400x150+400+300")  # Fixed geometry (width, height, x, y)
-
-    pygame.init()
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    pygame.display.set_caption("AI Cars")
+config_path = "./config.txt"
 
-    for i, g in genomes:
-        net = neat.nn.FeedForwardNetwork.create(g, config)
-        nets.append(net)
-        g.fitness = 0
-        cars.append(Car(WIDTH, HEIGHT, MAX_DISTANCE, START_POS, CAR_SIZE_X, CAR_SIZE_Y, BORDER_COLOR))
+current_generation = 0
 
-    clock = pygame.time.Clock()
-    raw_map = pygame.image.load(f"maps/map{MAP_NUMBER}.png")
-    game_map = pygame.transform.scale(raw_map, (WIDTH, HEIGHT)).convert()
 
+def run_simulation(genomes, config, sessions, headless=False, show_every=1, evaluator=None, cache=None,
+                   combine="mean", screening=None, screen_until=0, screen_keep=0.2):
+    # Every genome drives on the map of every session, the fitness on each map is combined by combine.
+    # Up to generation screen_until every genome drives on the (downscaled) screening sessions
+    # first, and only the best screen_keep fraction of them on the full size maps
     global current_generation
     current_generation += 1
 
-    start = time()
-
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                sys.exit()
-
-        # For each car get the acton it takes
-        for i, car in enumerate(cars):
-            output = nets[i].activate(car.get_data())
-            choice = output.index(max(output))
-            if choice == 0:
-                car.angle += 10  # Left
-            elif choice == 1:
-                car.angle -= 10  # Right
-            elif choice == 2:
-                if car.speed >= 14:
-                    car.speed -= 2  # Slow down
-            else:
-                car.speed += 2  # Speed up
-
-        # Check if car is still alive and increase fitness if yes and break loop if not
-        still_alive = 0
-        for i, car in enumerate(cars):
-            if car.is_alive():
-                still_alive += 1
-                car.update(game_map)
-                genomes[i][1].fitness += car.get_reward()
-            else:
-                genomes[i][1].fitness *= 0.5  # Death negative
-
-        if still_alive == 0 or time() - start > 10:
-            running = False
-
-        # Render
-        screen.blit(game_map, (0, 0))
-        for car in cars:
-            if car.is_alive():
-                car.draw(screen)
-
-        # Tkinter
-        for widget in window.winfo_children():
-            widget.destroy()
-        Label(window, text=f"Generation: {current_generation}", font=('Helvetica bold', 40)).pack()
-        Label(window, text=f"Still Alive: {still_alive}", font=('Helvetica bold', 40)).pack()
-        window.update()
-
-        pygame.display.flip()
-        clock.tick(60)
-
-    pygame.quit()
-    window.destroy()
-
-    # Save best genome every 50 generations
-    if current_generation % 50 == 0:
-        best_genome = max(genomes, key=lambda g: g[1].fitness)[1]  # Get the best genome
-        with open(f"checkpoint_gen{current_generation}.pkl", "wb") as f:
-            pickle.dump(best_genome, f)
-        print(f"Checkpoint saved at generation {current_generation}")
+    # Only open the windows for generations we actually want to watch
+    show = evaluator is None and not headless and current_generation % show_every == 0
+
+    def simulate(genome_list):
+        # Rewards and steps of shape (genomes, maps)
+        if evaluator is not None:
+            with sessions[0].profiler.phase("workers"):
+                rewards, steps = evaluator.simulate(genome_list)
+            for session, alive in zip(sessions, evaluator.alive):
+                session.profiler.record(alive)
+            return rewards, steps
+
+        # Only the first map is shown, the others run headless
+        results = [session.simulate(genome_list, config, current_generation, show and i == 0)
+                   for i, session in enumerate(sessions)]
+        return np.stack([r for r, _ in results], axis=1), np.stack([s for _, s in results], axis=1)
+
+    def evaluate(genome_list):
+        # Watched generations simulate every car, so the cached ones still show up on screen
+        if cache is not None:
+            return cache.evaluate(genome_list, simulate, refresh=show)
+        return simulate(genome_list)
+
+    genome_list = [g for _, g in genomes]
+    if screening is not None and current_generation <= screen_until:
+        # Speeds and rewards don't depend on the scale, so the screening results of the genomes
+        # that don't get through can stand in for a full size simulation
+        results = [session.simulate(genome_list, config, current_generation, show=False) for session in screening]
+        rewards, steps = np.stack([r for r, _ in results], axis=1), np.stack([s for _, s in results], axis=1)
+        passed = np.argsort(-combined_fitness(rewards, steps, MAX_STEPS, combine), kind="stable")
+        passed = passed[:max(1, int(np.ceil(screen_keep * len(genome_list))))]
+        rewards[passed], steps[passed] = evaluate([genome_list[i] for i in passed])
+    else:
+        rewards, steps = evaluate(genome_list)
+    fitness = combined_fitness(rewards, steps, MAX_STEPS, combine)
+
+    for i, (_, g) in enumerate(genomes):
+        g.fitness = float(fitness[i])
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the AI cars")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without any window or frame cap")
+    parser.add_argument("--show-every", type=int, default=1, metavar="N",
+                        help="only display every Nth generation")
+    parser.add_argument("--render-every", type=int, default=1, metavar="N",
+                        help="only draw every Nth simulation step of a displayed generation")
+    parser.add_argument("--top-k", type=int, metavar="K",
+                        help="only draw the K cars with the highest fitness so far")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only redraw the parts of the screen the cars moved over")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="evaluate genomes in N worker processes (implies --headless)")
+    parser.add_argument("--maps", type=int, nargs="+", default=[MAP_NUMBER], choices=sorted(START_POSITIONS),
+                        metavar="N", help="train on these maps at once, use --workers to simulate them in parallel")
+    parser.add_argument("--combine", choices=["mean", "min"], default="mean",
+                        help="how the fitness on each map is combined into one")
+    parser.add_argument("--geometry", choices=["raster", "vector"], default="raster",
+                        help="sense walls pixel by pixel, or as line segments traced from the maps")
+    parser.add_argument("--screen-until", type=int, default=0, metavar="GEN",
+                        help="up to generation GEN, screen every genome on downscaled maps first")
+    parser.add_argument("--screen-scale", type=float, default=0.5, metavar="S",
+                        help="size of the screening maps relative to the full size ones")
+    parser.add_argument("--screen-keep", type=float, default=0.2, metavar="FRACTION",
+                        help="fraction of the screened genomes that is simulated on the full size maps")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="append per-generation phase timings to FILE as JSON lines")
+    parser.add_argument("--cache-size", type=int, default=10000, metavar="N",
+                        help="remember the results of the last N distinct genomes, 0 to turn off")
+    parser.add_argument("--islands", type=int, default=1, metavar="N",
+                        help="evolve N populations in separate processes that swap their best genomes")
+    parser.add_argument("--island-maps", nargs="+", metavar="MAPS",
+                        help="maps of each island, comma separated, e.g. 1,2 3 4,5,6 (default: --maps for all)")
+    parser.add_argument("--migration-interval", type=int, default=10, metavar="M",
+                        help="generations between migrations between islands")
+    parser.add_argument("--migrants", type=int, default=3, metavar="K",
+                        help="best genomes every island sends to the next one")
+    parser.add_argument("--snapshot-every", type=int, default=SNAPSHOT_EVERY, metavar="N",
+                        help="save the whole population every N generations, 0 to turn off")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, metavar="DIR")
+    parser.add_argument("--resume", nargs="?", const=SNAPSHOT_DIR, metavar="PATH",
+                        help="carry on from a snapshot file, or the latest one in a directory")
+    args = parser.parse_args()
+
     # Load Config
     config = neat.config.Config(neat.DefaultGenome,
                                 neat.DefaultReproduction,
@@ -126,25 +147,111 @@ if __name__ == "__main__":
                                 config_path)
 
     # Try to load a saved genome
-    if os.path.exists(MODEL_FILE):
+    best_genome = None
+    if os.path.exists(MODEL_FILE) and not args.resume:
         with open(MODEL_FILE, "rb") as f:
             best_genome = pickle.load(f)
         print("Loaded best genome from file.")
-        population = neat.Population(config)
-        population.population[0] = best_genome  # Use saved best genome
-    else:
-        # Create new population
-        population = neat.Population(config)
-
-    # Add reporters
-    population.add_reporter(neat.StdOutReporter(True))
-    stats = neat.StatisticsReporter()
-    population.add_reporter(stats)
 
-    # Run Simulation
-    winner = population.run(run_simulation, 1000)
+    if args.islands > 1:
+        from islands import run_islands  # islands imports this module
+
+        # Islands run headless in processes of their own, from a new population
+        if args.resume:
+            parser.error("--resume can't be used with --islands")
+        if args.workers > 1:
+            parser.error("--workers can't be used with --islands, every island is a process already")
+        if args.profile:
+            parser.error("--profile can't be used with --islands")
+        if args.show_every != 1 or args.render_every != 1 or args.top_k is not None or args.dirty_rects:
+            parser.error("--islands runs headless, so --show-every, --render-every, --top-k and --dirty-rects "
+                         "can't be used with it")
+
+        # Every island trains on its own set of maps, going round the list given
+        specs = args.island_maps or [",".join(map(str, args.maps))]
+        try:
+            island_maps = [[int(n) for n in specs[i % len(specs)].split(",")] for i in range(args.islands)]
+        except ValueError:
+            parser.error(f"--island-maps takes comma separated map numbers, got {' '.join(specs)}")
+        if any(n not in START_POSITIONS for maps in island_maps for n in maps):
+            parser.error(f"--island-maps can only use maps {sorted(START_POSITIONS)}")
+
+        settings = {"geometry": args.geometry, "cache_size": args.cache_size, "screen_until": args.screen_until,
+                    "screen_scale": args.screen_scale, "screen_keep": args.screen_keep,
+                    "snapshot_every": args.snapshot_every, "snapshot_dir": args.snapshot_dir}
+        winner = run_islands(config, island_maps, args.combine, GENERATIONS, args.migration_interval, args.migrants,
+                             start_genome=best_genome, settings=settings)
+    else:
+        if args.resume:
+            # Carry on with the exact population, species and random state of the snapshot
+            snapshot = latest_snapshot(args.resume) if os.path.isdir(args.resume) else args.resume
+            population = restore_population(snapshot, config)
+            current_generation = population.generation
+            print(f"Resumed from {snapshot} at generation {population.generation}.")
+        else:
+            # Create new population
+            population = neat.Population(config)
+            if best_genome is not None:
+                population.population[0] = best_genome  # Use saved best genome
+
+        # Add reporters
+        population.add_reporter(neat.StdOutReporter(True))
+        stats = neat.StatisticsReporter()
+        population.add_reporter(stats)
+
+        profiler = NULL_PROFILER
+        if args.profile:
+            profiler = Profiler(args.profile)
+            population.add_reporter(profiler)
+
+        snapshotter = None
+        if args.snapshot_every > 0:
+            snapshotter = Snapshotter(population, args.snapshot_dir, args.snapshot_every)
+            population.add_reporter(snapshotter)
+
+        # Set up the window and maps once for all generations
+        sessions = [SimulationSession(f"maps/map{map_number}.png", WIDTH, HEIGHT, BORDER_COLOR,
+                                      START_POSITIONS[map_number], MAX_STEPS, MAX_DISTANCE, (CAR_SIZE_X, CAR_SIZE_Y),
+                                      show_stats=True, profiler=profiler,
+                                      render_policy=RenderPolicy(args.render_every, args.top_k, args.dirty_rects),
+                                      geometry=args.geometry)
+                    for map_number in args.maps]
+
+        # Cheap, rough versions of the maps, only simulated in this process
+        screening = None
+        if args.screen_until > 0:
+            screening = [SimulationSession(f"maps/map{map_number}.png", WIDTH, HEIGHT, BORDER_COLOR,
+                                           START_POSITIONS[map_number], MAX_STEPS, MAX_DISTANCE,
+                                           (CAR_SIZE_X, CAR_SIZE_Y), profiler=profiler, geometry=args.geometry,
+                                           scale=args.screen_scale)
+                         for map_number in args.maps]
+
+        evaluator = None
+        if args.workers > 1:
+            evaluator = ParallelEvaluator(args.workers, [(session.track, session.start_pos) for session in sessions],
+                                          config, MAX_STEPS, MAX_DISTANCE, (CAR_SIZE_X, CAR_SIZE_Y))
+
+        cache = None
+        if args.cache_size > 0:
+            cache = FitnessCache(tuple(session.context for session in sessions), args.cache_size)
+
+        # Run Simulation
+        try:
+            winner = population.run(partial(run_simulation, sessions=sessions, headless=args.headless,
+                                            show_every=args.show_every, evaluator=evaluator, cache=cache,
+                                            combine=args.combine, screening=screening,
+                                            screen_until=args.screen_until, screen_keep=args.screen_keep),
+                                    GENERATIONS - population.generation)
+        finally:
+            if snapshotter is not None:
+                snapshotter.close()
+            if evaluator is not None:
+                evaluator.close()
+            for session in sessions + (screening or []):
+                session.close()
 
     # Save the best genome
     with open(MODEL_FILE, "wb") as f:
         pickle.dump(winner, f)
+    BatchNetwork.create([winner], config).save(EXPORT_FILE)
     print("Best genome saved.")
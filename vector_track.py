@@ -0,0 +1,356 @@
+import json
+import math
+import os
+import numpy as np
+import pygame
+from checkpoints import checkpoint_radius, load_checkpoints
+from track import CACHE_DIR, Track, load_cached, wall_mask
+
+# Side of the square grid cells the wall segments are filed under, in pixels
+GRID_CELL = 32
+
+# Outlines are simplified as long as they stay within this many pixels of the pixel edges, and
+# only ever by moving into the open track. That is enough to turn a staircase of single pixel
+# steps into one straight line, and a wall never loses a corner a ray could pass through
+SIMPLIFY_TOLERANCE = 1.0
+
+
+def trace_contours(walls):
+    # Outlines of the walls as closed loops of points along the pixel edges, with x, y the top
+    # left corner of pixel x, y. Every loop keeps the wall on the same side, see simplify.
+    # Everything around the map counts as wall, so the map border is part of the outlines
+    width, height = walls.shape
+    padded = np.ones((width + 2, height + 2), dtype=bool)
+    padded[1:-1, 1:-1] = walls
+
+    # Pixel edges between a wall and open track, directed so the wall is on the side of
+    # (-dy, dx) when going from (x0, y0) to (x1, y1)
+    left, right = padded[:-1, 1:-1], padded[1:, 1:-1]
+    above, below = padded[1:-1, :-1], padded[1:-1, 1:]
+    edges = []
+    for mask, (x0, y0, x1, y1) in ((left & ~right, (0, 0, 0, 1)), (right & ~left, (0, 1, 0, 0)),
+                                   (above & ~below, (1, 0, 0, 0)), (below & ~above, (0, 0, 1, 0))):
+        cells = np.argwhere(mask)
+        edges.append(np.hstack((cells + (x0, y0), cells + (x1, y1))))
+    edges = np.vstack(edges)
+
+    following = {}
+    for x0, y0, x1, y1 in edges.tolist():
+        following.setdefault((x0, y0), []).append((x1, y1))
+
+    loops = []
+    for start in list(following):
+        while following[start]:
+            loop = [start]
+            point = following[start].pop()
+            while point != start:
+                loop.append(point)
+                options = following[point]
+                if len(options) > 1:
+                    # Where walls touch diagonally, turn away from the wall, onto the other one,
+                    # so they are outlined together like they are for the raster sweep
+                    dx, dy = point[0] - loop[-2][0], point[1] - loop[-2][1]
+                    options.sort(key=lambda end: end == (point[0] + dy, point[1] - dx))
+                point = options.pop()
+            loops.append(np.array(loop, dtype=np.float64))
+    return loops
+
+
+def simplify(points, tolerance=SIMPLIFY_TOLERANCE):
+    # Douglas-Peucker: keep only the points needed to stay within tolerance of the polyline.
+    # The wall is on the side of (-dy, dx) of every chord, the points a chord skips may lie up
+    # to tolerance on that side (the wall grows into the open track) but never on the other
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        chord = points[last] - points[first]
+        offsets = points[first + 1:last] - points[first]
+        length = math.hypot(*chord)
+        if length == 0:
+            error = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            side = (chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+            error = np.maximum(side - tolerance, -side)
+        farthest = int(np.argmax(error))
+        if error[farthest] > 1e-9:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.extend(((first, middle), (middle, last)))
+    return points[keep]
+
+
+def wall_segments(walls, max_length=GRID_CELL):
+    # Wall outlines as line segments (x0, y0, x1, y1), none longer than max_length
+    segments = []
+    for loop in trace_contours(walls):
+        points = simplify(np.vstack((loop, loop[:1])))
+        start, end = points[:-1], points[1:]
+
+        # Split long segments, so each is filed under only a few grid cells
+        pieces = np.maximum(1, np.ceil(np.hypot(*(end - start).T) / max_length)).astype(np.int64)
+        index = np.repeat(np.arange(len(start)), pieces)
+        step = np.arange(len(index)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        frac0, frac1 = step / pieces[index], (step + 1) / pieces[index]
+        delta = end[index] - start[index]
+        segments.append(np.hstack((start[index] + delta * frac0[:, None], start[index] + delta * frac1[:, None])))
+    return np.vstack(segments)
+
+
+def build_grid(min_x, min_y, max_x, max_y, cell, columns, rows):
+    # Files every item under each grid cell its bounding box overlaps. Cell c holds
+    # items[starts[c]:starts[c + 1]], with c = column * rows + row
+    x0 = np.clip(np.floor(min_x / cell).astype(np.int64), 0, columns - 1)
+    x1 = np.clip(np.floor(max_x / cell).astype(np.int64), 0, columns - 1)
+    y0 = np.clip(np.floor(min_y / cell).astype(np.int64), 0, rows - 1)
+    y1 = np.clip(np.floor(max_y / cell).astype(np.int64), 0, rows - 1)
+
+    spans = (x1 - x0 + 1) * (y1 - y0 + 1)
+    items = np.repeat(np.arange(len(spans)), spans)
+    local = np.arange(len(items)) - np.repeat(np.cumsum(spans) - spans, spans)
+    span_y = (y1 - y0 + 1)[items]
+    cells = (x0[items] + local // span_y) * rows + y0[items] + local % span_y
+
+    order = np.argsort(cells, kind="stable")
+    starts = np.searchsorted(cells[order], np.arange(columns * rows + 1))
+    return starts, items[order]
+
+
+def gather(starts, items, cells):
+    # Every (query, item) pair for the items filed under each query's cell
+    counts = starts[cells + 1] - starts[cells]
+    query = np.repeat(np.arange(len(cells)), counts)
+    offset = np.arange(len(query)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return query, items[starts[cells][query] + offset]
+
+
+class VectorTrack:
+    # Walls as line segments instead of pixels. The radar and collision checks intersect rays
+    # and car outlines with the segments of the grid cells they pass through, which gives
+    # exact distances and doesn't need a bitmap of the map at all once it is compiled.
+    # Has the same interface CarFleet uses as Track
+
+    def __init__(self, segments, width, height, cell=GRID_CELL, source=None, directory=None, checkpoints=None):
+        self.segments = segments
+        self.width = width
+        self.height = height
+
+        # Segments per grid cell, the cells cover the map including its far edges. Plenty of
+        # segments lie right on a cell border, those go in the cells on both sides of it
+        self.cell = cell
+        self.columns, self.rows = width // cell + 1, height // cell + 1
+        margin = 1e-6 * cell
+        self.starts, self.items = build_grid(np.minimum(segments[:, 0], segments[:, 2]) - margin,
+                                             np.minimum(segments[:, 1], segments[:, 3]) - margin,
+                                             np.maximum(segments[:, 0], segments[:, 2]) + margin,
+                                             np.maximum(segments[:, 1], segments[:, 3]) + margin,
+                                             cell, self.columns, self.rows)
+
+        # Checkpoints in driving order, filed under cells as large as the checkpoint radius,
+        # so only the 3x3 cells around a car need looking at
+        self.checkpoints = checkpoints
+        self.checkpoint_radius = checkpoint_radius(width)
+        if checkpoints is not None:
+            self.checkpoint_columns = int(width // self.checkpoint_radius) + 1
+            self.checkpoint_rows = int(height // self.checkpoint_radius) + 1
+            self.checkpoint_starts, self.checkpoint_items = build_grid(
+                checkpoints[:, 0], checkpoints[:, 1], checkpoints[:, 0], checkpoints[:, 1], self.checkpoint_radius,
+                self.checkpoint_columns, self.checkpoint_rows)
+
+        # Map image, only loaded when something gets drawn
+        self.source = source
+        self._surface = None
+
+        self.directory = directory
+
+    @property
+    def surface(self):
+        if self._surface is None and self.source is not None:
+            self._surface = pygame.transform.scale(pygame.image.load(self.source), (self.width, self.height))
+            if pygame.display.get_surface() is not None:
+                self._surface = self._surface.convert()
+        return self._surface
+
+    @surface.setter
+    def surface(self, surface):
+        self._surface = surface
+
+    @classmethod
+    def compile(cls, path, width, height, border_color):
+        # The bitmap is only needed to find the walls, it is dropped as soon as they are traced
+        raw_map = pygame.image.load(path)
+        pixels = pygame.surfarray.array3d(pygame.transform.scale(raw_map, (width, height)))
+        segments = wall_segments(wall_mask(pixels, border_color))
+
+        scale_x, scale_y = width / raw_map.get_width(), height / raw_map.get_height()
+        checkpoints = np.array([(x * scale_x, y * scale_y) for x, y in load_checkpoints(path)], dtype=np.float64)
+        return cls(segments, width, height, source=path, checkpoints=checkpoints if len(checkpoints) else None)
+
+    @classmethod
+    def load(cls, path, width, height, border_color, cache_dir=CACHE_DIR):
+        # Tracks traced with other settings are cached apart
+        return load_cached(cls, path, width, height, border_color, cache_dir,
+                           kind=f"vector-{GRID_CELL}-{SIMPLIFY_TOLERANCE}")
+
+    def save(self, directory):
+        np.save(os.path.join(directory, "segments.npy"), self.segments)
+        if self.checkpoints is not None:
+            np.save(os.path.join(directory, "checkpoints.npy"), self.checkpoints)
+        with open(os.path.join(directory, "track.json"), "w") as f:
+            json.dump({"width": self.width, "height": self.height, "cell": self.cell, "source": self.source}, f)
+
+    @classmethod
+    def open(cls, directory):
+        with open(os.path.join(directory, "track.json")) as f:
+            info = json.load(f)
+        segments = np.load(os.path.join(directory, "segments.npy"))
+        checkpoints = None
+        if os.path.exists(os.path.join(directory, "checkpoints.npy")):
+            checkpoints = np.load(os.path.join(directory, "checkpoints.npy"))
+        return cls(segments, info["width"], info["height"], info["cell"], info["source"], directory, checkpoints)
+
+    def intersect(self, query, walls, start_x, start_y, dir_x, dir_y):
+        # How far along start + t * dir every query crosses its wall segment, inf where it doesn't
+        segment = self.segments[walls]
+        wall_dx, wall_dy = segment[:, 2] - segment[:, 0], segment[:, 3] - segment[:, 1]
+        rel_x, rel_y = segment[:, 0] - start_x[query], segment[:, 1] - start_y[query]
+        dx, dy = dir_x[query], dir_y[query]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denom = dx * wall_dy - dy * wall_dx
+            t = (rel_x * wall_dy - rel_y * wall_dx) / denom
+            u = (rel_x * dy - rel_y * dx) / denom
+        # A little slack, so a ray through the point two segments share can't slip between them
+        return np.where((denom != 0) & (t >= 0) & (u >= -1e-9) & (u <= 1 + 1e-9), t, np.inf)
+
+    def cast_rays(self, origin_x, origin_y, angle_rad, max_distance):
+        # Walks every ray through the grid cells it passes, until a segment filed under the
+        # current cell is hit before the ray leaves it. Rays starting off the map hit right away
+        cos, sin = np.cos(angle_rad), np.sin(angle_rad)
+        origin_x, origin_y = origin_x.astype(np.float64), origin_y.astype(np.float64)
+        length = np.zeros(cos.shape)
+
+        column = np.floor(origin_x / self.cell).astype(np.int64)
+        row = np.floor(origin_y / self.cell).astype(np.int64)
+        step_x, step_y = np.where(cos > 0, 1, -1), np.where(sin > 0, 1, -1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Distance along the ray to the next column and row boundary, and between boundaries
+            next_x = np.where(cos != 0, ((column + (cos > 0)) * self.cell - origin_x) / cos, np.inf)
+            next_y = np.where(sin != 0, ((row + (sin > 0)) * self.cell - origin_y) / sin, np.inf)
+            delta_x = np.where(cos != 0, self.cell / np.abs(cos), np.inf)
+            delta_y = np.where(sin != 0, self.cell / np.abs(sin), np.inf)
+
+        inside = (origin_x >= 0) & (origin_x <= self.width) & (origin_y >= 0) & (origin_y <= self.height)
+        active = np.flatnonzero(inside)
+        while active.size:
+            query, walls = gather(self.starts, self.items, column[active] * self.rows + row[active])
+            t = self.intersect(query, walls, origin_x[active], origin_y[active], cos[active], sin[active])
+            nearest = np.full(active.shape, np.inf)
+            np.minimum.at(nearest, query, t)
+
+            # Hits right on the border of the cell count too, the map border has no cell beyond it
+            leave = np.minimum(next_x[active], next_y[active])
+            done = (nearest <= leave + 1e-6) | (leave >= max_distance)
+            length[active[done]] = np.minimum(nearest[done], max_distance)
+
+            active = active[~done]
+            across = next_x[active] <= next_y[active]
+            column[active[across]] += step_x[active[across]]
+            next_x[active[across]] += delta_x[active[across]]
+            row[active[~across]] += step_y[active[~across]]
+            next_y[active[~across]] += delta_y[active[~across]]
+
+            # Only a ray exactly along the map border can get this far without hitting it
+            on_grid = (column[active] >= 0) & (column[active] < self.columns) & \
+                      (row[active] >= 0) & (row[active] < self.rows)
+            length[active[~on_grid]] = max_distance
+            active = active[on_grid]
+
+        return origin_x + cos * length, origin_y + sin * length
+
+    def sweep(self, start_x, start_y, end_x, end_y):
+        # True for every segment from start to end that crosses a wall, looking at the
+        # wall segments of every grid cell its bounding box overlaps
+        x0 = np.clip(np.floor(np.minimum(start_x, end_x) / self.cell).astype(np.int64), 0, self.columns - 1)
+        x1 = np.clip(np.floor(np.maximum(start_x, end_x) / self.cell).astype(np.int64), 0, self.columns - 1)
+        y0 = np.clip(np.floor(np.minimum(start_y, end_y) / self.cell).astype(np.int64), 0, self.rows - 1)
+        y1 = np.clip(np.floor(np.maximum(start_y, end_y) / self.cell).astype(np.int64), 0, self.rows - 1)
+        dir_x, dir_y = end_x - start_x, end_y - start_y
+
+        hit = np.zeros(start_x.shape, dtype=bool)
+        if not hit.size:
+            return hit
+        for i in range(int((x1 - x0).max()) + 1):
+            for j in range(int((y1 - y0).max()) + 1):
+                rows = np.flatnonzero((x0 + i <= x1) & (y0 + j <= y1) & ~hit)
+                query, walls = gather(self.starts, self.items, (x0[rows] + i) * self.rows + y0[rows] + j)
+                t = self.intersect(query, walls, start_x[rows], start_y[rows], dir_x[rows], dir_y[rows])
+                hit[rows[query[t <= 1]]] = True
+        return hit
+
+    def box_hits(self, corner_x, corner_y):
+        # Which edges of the boxes given by their corners in order, shape (boxes, 4), cross a
+        # wall, edge k going from corner k to the next one. A box can only end up completely
+        # inside a wall by jumping into it, which the fleet's sweep catches
+        next_x, next_y = np.roll(corner_x, -1, axis=1), np.roll(corner_y, -1, axis=1)
+        return self.sweep(corner_x.ravel(), corner_y.ravel(), next_x.ravel(), next_y.ravel()).reshape(corner_x.shape)
+
+    def checkpoint_at(self, x, y):
+        # Id of the nearest checkpoint within the checkpoint radius of every point, -1 for none
+        column = np.floor(x / self.checkpoint_radius).astype(np.int64)
+        row = np.floor(y / self.checkpoint_radius).astype(np.int64)
+        points, candidates = [], []
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                c, r = column + i, row + j
+                rows = np.flatnonzero((c >= 0) & (c < self.checkpoint_columns) & (r >= 0) & (r < self.checkpoint_rows))
+                query, found = gather(self.checkpoint_starts, self.checkpoint_items,
+                                      c[rows] * self.checkpoint_rows + r[rows])
+                points.append(rows[query])
+                candidates.append(found)
+        points, candidates = np.concatenate(points), np.concatenate(candidates)
+
+        dist_sq = (self.checkpoints[candidates, 0] - x[points]) ** 2 + (self.checkpoints[candidates, 1] - y[points]) ** 2
+        close = dist_sq <= self.checkpoint_radius ** 2
+        points, candidates, dist_sq = points[close], candidates[close], dist_sq[close]
+
+        # Sorted by point and then distance, the first candidate of every point is its nearest
+        order = np.lexsort((dist_sq, points))
+        first = order[np.r_[True, points[order][1:] != points[order][:-1]]] if order.size else order
+        ids = np.full(x.shape, -1, dtype=np.int64)
+        ids[points[first]] = candidates[first]
+        return ids
+
+
+if __name__ == "__main__":
+    # Compare the analytic radar with the raster one. The raster radar stops at the first sample
+    # inside a wall, up to a pixel or so past it, so a vector ray that goes further than that
+    # went through a wall
+    from time import perf_counter
+    rng = np.random.default_rng(0)
+    for map_number in range(1, 7):
+        path = f"maps/map{map_number}.png"
+        raster = Track.load(path, 1920, 1060, (255, 255, 255, 255))
+        started = perf_counter()
+        vector = VectorTrack.compile(path, 1920, 1060, (255, 255, 255, 255))
+        compiled = perf_counter() - started
+
+        walls = np.asarray(raster.walls)
+        open_pixels = np.argwhere(~walls & (raster.distance > 2))
+        origins = open_pixels[rng.integers(len(open_pixels), size=20000)] + rng.random((20000, 2))
+        angles = rng.uniform(0, 2 * math.pi, 20000)
+
+        x, y = raster.cast_rays(origins[:, 0], origins[:, 1], angles, 300)
+        raster_dist = np.hypot(x - origins[:, 0], y - origins[:, 1])
+        x, y = vector.cast_rays(origins[:, 0], origins[:, 1], angles, 300)
+        vector_dist = np.hypot(x - origins[:, 0], y - origins[:, 1])
+        difference = np.abs(vector_dist - raster_dist)
+        overshoot = np.max(vector_dist - raster_dist)
+
+        print(f"Map {map_number}: {len(vector.segments)} segments, compiled in {compiled:.2f}s, "
+              f"radar within 2 px for {np.mean(difference <= 2):.2%} of rays, median {np.median(difference):.2f} px, "
+              f"at most {overshoot:.2f} px further")
+        assert overshoot <= 1, f"A ray on map {map_number} went {overshoot:.2f} px further than the raster radar"